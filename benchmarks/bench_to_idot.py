@@ -0,0 +1,204 @@
+"""
+Benchmarks for the stages of the DoE to iDOT pipeline
+
+Generates synthetic DoE designs from a fixed seed, runs each stage of the pipeline on them and records the wall time
+and peak memory of every stage. Run from the root of the repo:
+
+    python -m benchmarks.bench_to_idot --output bench.json
+    python -m benchmarks.bench_to_idot --output new.json --compare bench.json
+
+The output is a json file, --compare exits with status 1 if any stage got slower than --threshold times the baseline.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from to_idot import doe_to_idot as dti
+
+# concentration levels used in the synthetic designs, 0 means the reagent isn't added to that well
+LEVELS = [0, 0.5, 1, 1.5, 2, 5]
+STOCK_CONC = 100
+FINAL_VOLUME = 20
+
+
+def synthetic_design(n_conditions, n_reagents, seed=0):
+    """
+    Makes a random DoE design, the same seed always gives the same design
+    :param n_conditions: number of conditions (rows)
+    :param n_reagents: number of reagents (columns)
+    :param seed: seed for the random number generator
+    :return:
+    design: dataframe of target concentrations
+    starting_conc_dict: stock concentration of every reagent
+    """
+    rng = np.random.default_rng(seed)
+    columns = [f'Reagent {i + 1}' for i in range(n_reagents)]
+    design = pd.DataFrame(rng.choice(LEVELS, size=(n_conditions, n_reagents)), columns=columns)
+    return design, {col: STOCK_CONC for col in columns}
+
+
+def _run_stages(design, starting_conc_dict, replicates, orientation):
+    """
+    Runs the pipeline once, timing each stage
+    :return: dictionary of stage name to (seconds, output rows)
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    list_df, _ = dti.generate_target_vols(design, FINAL_VOLUME, starting_conc_dict, replicates=replicates, orientation=orientation)
+    timings['generate_target_vols'] = (time.perf_counter() - start, sum(len(df) for df in list_df))
+
+    start = time.perf_counter()
+    # the run-level planner spills onto as many source plates as the design needs
+    worklists = dti.get_source_wells(list_df)
+    timings['get_source_wells'] = (time.perf_counter() - start, sum(len(df) for df in worklists))
+
+    with open(os.devnull, 'w', newline='') as csv_file:
+        start = time.perf_counter()
+        dti.generate_csv_file(csv_file, worklists)
+        timings['generate_csv_file'] = (time.perf_counter() - start, len(worklists))
+    return timings
+
+
+def _peak_memory(design, starting_conc_dict, replicates, orientation):
+    """
+    Runs the pipeline again under tracemalloc (kept separate from the timed runs as tracing slows everything down)
+    :return: dictionary of stage name to peak bytes allocated during that stage
+    """
+    peaks = {}
+
+    def traced(stage, func, *args, **kwargs):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = func(*args, **kwargs)
+        peaks[stage] = tracemalloc.get_traced_memory()[1] - before
+        return result
+
+    tracemalloc.start()
+    try:
+        list_df, _ = traced('generate_target_vols', dti.generate_target_vols, design, FINAL_VOLUME, starting_conc_dict, replicates=replicates, orientation=orientation)
+        worklists = traced('get_source_wells', dti.get_source_wells, list_df)
+        with open(os.devnull, 'w', newline='') as csv_file:
+            traced('generate_csv_file', dti.generate_csv_file, csv_file, worklists)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_case(n_conditions, n_reagents, replicates, orientation, repeat=3, seed=0, memory=True):
+    """
+    Benchmarks one combination of design size and options
+    :return: list of result dictionaries, one per stage
+    """
+    design, starting_conc_dict = synthetic_design(n_conditions, n_reagents, seed)
+    best = {}
+    for _ in range(repeat):
+        for stage, (seconds, rows) in _run_stages(design, starting_conc_dict, replicates, orientation).items():
+            if stage not in best or seconds < best[stage][0]:
+                best[stage] = (seconds, rows)
+    peaks = _peak_memory(design, starting_conc_dict, replicates, orientation) if memory else {}
+    return [
+        {
+            'conditions': n_conditions,
+            'reagents': n_reagents,
+            'replicates': replicates,
+            'orientation': orientation,
+            'stage': stage,
+            'seconds': seconds,
+            'output_rows': rows,
+            'peak_bytes': peaks.get(stage),
+        }
+        for stage, (seconds, rows) in best.items()
+    ]
+
+
+def _case_key(result):
+    return (result['conditions'], result['reagents'], result['replicates'], result['orientation'], result['stage'])
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the timings against a previous run
+    :param results: results from this run
+    :param baseline: results loaded from a previous output file
+    :param threshold: ratio of new time to baseline time counted as a regression
+    :return: list of (result, ratio) for every stage slower than the threshold
+    """
+    baseline_seconds = {_case_key(result): result['seconds'] for result in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = baseline_seconds.get(_case_key(result))
+        if previous:
+            ratio = result['seconds'] / previous
+            if ratio > threshold:
+                regressions.append((result, ratio))
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench_to_idot', description='Benchmarks the stages of the DoE to iDOT pipeline on synthetic designs')
+    parser.add_argument('--conditions', type=int, nargs='+', default=[96, 1000, 10000, 100000], help='numbers of conditions to sweep')
+    parser.add_argument('--reagents', type=int, nargs='+', default=[3, 6, 12], help='numbers of reagents to sweep')
+    parser.add_argument('--replicates', type=int, nargs='+', default=[1, 3], help='numbers of replicates to sweep')
+    parser.add_argument('--orientations', nargs='+', default=['by_columns', 'by_rows'], choices=['by_columns', 'by_rows'])
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case, the fastest is kept')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic designs')
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slower) peak memory runs')
+    parser.add_argument('--output', help='json file to write the results to')
+    parser.add_argument('--compare', help='json file from a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression by --compare')
+    args = parser.parse_args(argv)
+
+    results = []
+    for n_conditions in args.conditions:
+        for n_reagents in args.reagents:
+            for replicates in args.replicates:
+                for orientation in args.orientations:
+                    case_results = run_case(n_conditions, n_reagents, replicates, orientation, repeat=args.repeat, seed=args.seed, memory=not args.no_memory)
+                    for result in case_results:
+                        peak = f"{result['peak_bytes'] / 2**20:9.1f} MiB" if result['peak_bytes'] is not None else ''
+                        print(f"{n_conditions:>7} cond {n_reagents:>3} reag {replicates:>2} rep {orientation:<10} {result['stage']:<34} {result['seconds']:9.4f} s {peak}")
+                    results.extend(case_results)
+
+    output = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for result, ratio in regressions:
+            print(f"REGRESSION {_case_key(result)}: {ratio:.2f}x slower than {args.compare}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
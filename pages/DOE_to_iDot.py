@@ -1,33 +1,107 @@
-import pandas as pd
-import streamlit as st
+import os
 import tempfile
+import time
+
+import streamlit as st
 
 import to_idot
 
 session = st.session_state
 
+
+@st.cache_resource
+def upload_store():
+    """
+    One store of the parsed uploads for the whole server, keyed on the sha256 of the file. Sessions only keep the hash
+    and read the design back memory-mapped, so a design opened by the whole lab is held once.
+    Set TO_IDOT_UPLOAD_DIR and TO_IDOT_UPLOAD_CAP_MB to move the store or change its size cap.
+    """
+    directory = os.environ.get('TO_IDOT_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'to_idot_uploads'))
+    return to_idot.UploadStore(directory, max_bytes=int(os.environ.get('TO_IDOT_UPLOAD_CAP_MB', 512)) * 1024 ** 2)
+
+
+def remove_finished_file(result):
+    """
+    Deletes the iDOT file of a conversion the job executor has forgotten
+    :param result: the job's result, (path of the finished file, estimated run time)
+    """
+    try:
+        os.unlink(result[0])
+    except FileNotFoundError:
+        pass
+
+
+@st.cache_resource
+def conversion_jobs():
+    """
+    One job executor for the whole server, conversions run on its (bounded) worker threads instead of the script thread.
+    Jobs are keyed on the file hash and parameters, so the same conversion is only ever run once while it is remembered.
+    Finished files are kept on disk, only their paths are remembered, and deleted when their job is forgotten.
+    """
+    return to_idot.JobExecutor(max_workers=2, max_finished=32, discard=remove_finished_file)
+
+
+@st.cache_resource(max_entries=16)
+def design_pipeline(file_digest, _in_df):
+    """
+    One incremental pipeline per uploaded design, shared by every session. It remembers the volumes and source well
+    allocations between conversions, so changing a stock concentration or the replicates only redoes what that changes.
+    :param file_digest: sha256 of the uploaded bytes
+    :param _in_df: the design, from upload_store
+    """
+    return to_idot.DoePipeline(_in_df)
+
+
+def build_worklist(pipeline, final_volume, stock_concs, replicates, orientation, plate_size, optimize_order, dead_volume, progress=None):
+    """
+    Runs the DoE to iDOT conversion, on a job executor thread
+    :param pipeline: DoePipeline of the design
+    :param final_volume: the final volume in each well
+    :param stock_concs: sorted tuple of (reagent, starting concentration) pairs
+    :param replicates: the number of replicates per well/condition
+    :param orientation: by_columns or by_rows
+    :param plate_size: number of wells on each target plate
+    :param optimize_order: reorder the dispenses to shorten the run
+    :param dead_volume: volume left in each source well that can't be dispensed, in ul
+    :param progress: progress callback from the job
+    :return: path of the finished iDOT file (a temporary file, see remove_finished_file) and the estimated run time in seconds
+    """
+    source_plate = to_idot.SourcePlateType(dead_volume_pl=int(to_idot.units.to_picolitres(dead_volume)))
+    handle, finished_path = tempfile.mkstemp(prefix='idot_', suffix='.csv')
+    try:
+        with os.fdopen(handle, 'w', newline='') as finished_file:
+            run_time = pipeline.run(finished_file, final_volume=final_volume, starting_conc_dict=dict(stock_concs), replicates=replicates, orientation=orientation, plate_size=plate_size, source_plate=source_plate, optimize_order=optimize_order, progress=progress)
+    except BaseException:
+        os.unlink(finished_path)
+        raise
+    return finished_path, run_time
+
+
 #from st_aggrid import AgGrid, GridOptionsBuilder
 
 st.set_page_config(layout="wide")
 
 st.title("Welcome to the DoE to iDOT setup page")
 
-if "source_file" not in session:
-    session.source_file = None
+if "design_digest" not in session:
+    # reference to the design in upload_store, the session never holds the design itself
+    session.design_digest = None
 if "file_done" not in session:
     session.file_done = False
-if "in_df" not in session:
-    session.in_df = None
 if "params_done" not in session:
     session.param_done = False
+if "doe_job" not in session:
+    # the job itself is kept (not just its id) so its result stays available for the rest of the session
+    session.doe_job = None
+    session.doe_job_key = None
 
 with st.form("File submission"):
-    source_file = st.file_uploader("Upload your DoE csv template", ["csv","xlsx"])
-    session.source_file = source_file
+    source_file = st.file_uploader("Upload your DoE csv template", ["csv","xlsx","parquet","feather","arrow"])
     submit_file_button = st.form_submit_button("Submit")
 
 if submit_file_button:
     session.file_done = True
+    session.design_digest = None
 
 if session.file_done:
 
@@ -35,26 +109,19 @@ if session.file_done:
         st.warning("No file uploaded", icon="⚠")
         st.rerun()
 
-    try:
-        df = pd.read_csv(source_file)
-        columns = df.columns
-    except UnicodeDecodeError:
-        df = pd.read_excel(source_file)
-        columns = df.columns
-    else:
-        st.warning("File type unknown, use CSV or XLSX", icon="⚠")
+    #parsed and stored once, whichever session uploads it first (or again after it was evicted)
+    file_digest, df = upload_store().get_or_put(source_file.getvalue())
+    session.design_digest = file_digest
+    columns = df.columns
 
 
     if columns is not None:
-        component_name_list = []
         concentration_list = []
         units_list = []
         ncols = len(columns)
 
-    session.in_df = df
-
     data_preview=st.expander("Preview", expanded=False)
-    data_preview.dataframe(session.in_df, use_container_width=True)
+    data_preview.dataframe(df, use_container_width=True)
 
     destination_name = st.text_input("Name for iDOT file")
     final_well_volume = st.number_input("Final well volume", 0)
@@ -64,13 +131,16 @@ if session.file_done:
         orientation = "by_rows"
     else:
         orientation = "by_columns"
+    plate_size = st.selectbox("Target plate format (wells)", [96, 384, 1536], index=0)
+    optimize_order = st.checkbox("Optimise dispense order for a shorter run")
+    dead_volume = st.number_input("Source well dead volume (ul)", min_value=0.0, max_value=79.0, value=0.0)
 
     st.write("Don't forget to check that the conc. units are the same between source file and what is here")
 
     ui_cols = st.columns(ncols)
     for i, x in enumerate(ui_cols):
-        comp_input = x.text_input(f"Component {i+1}", f"{columns[i]}", key=1+i)
-        component_name_list.append(comp_input)
+        # the stocks are matched to the design's column names, so the components can't be renamed here
+        x.text_input(f"Component {i+1}", f"{columns[i]}", key=1+i, disabled=True)
         conc_input = x.text_input(f"{columns[i]} conc.", 0, key=100+i)
         concentration_list.append(conc_input)
         units_input = x.selectbox(f"{columns[i]} units", ['mM', 'uM', 'nM', 'mg/mL', 'ug/mL', 'ng/mL', 'x'], key=200+i)
@@ -83,20 +153,46 @@ if session.file_done:
 
 if (session.file_done and session.param_done):
     conc_dict = {}
-    for i, name in enumerate(component_name_list):
-        conc_dict[name] = float(concentration_list[i])
-
-    stringstore = None
-
-    with tempfile.TemporaryFile(mode="w+", newline='') as finished_file:
-        to_idot.doe_to_idot_main(session.in_df, final_well_volume, conc_dict, finished_file, replicates=replicates, orientation=orientation)
-        finished_file.seek(0)
-        stringstore = finished_file.read()
-
-    download_button = st.download_button(
-        label="Download finished file",
-        data=stringstore,
-        file_name=destination_name,
-        mime="text/csv"
-    )
+    for i, name in enumerate(columns):
+        # the index column some csv exports add isn't a reagent
+        if name != 'Unnamed: 0':
+            conc_dict[name] = float(concentration_list[i])
+
+    stock_concs = tuple(sorted(conc_dict.items()))
+    job_params = (float(final_well_volume), stock_concs, int(replicates), orientation, int(plate_size), optimize_order, float(dead_volume))
+    jobs = conversion_jobs()
+    job_key = (file_digest,) + job_params
+    if session.doe_job is None or session.doe_job_key != job_key:
+        if session.doe_job is not None:
+            # the parameters changed, the old conversion is cancelled unless another session is waiting for it too
+            jobs.cancel(session.doe_job.id)
+        job_id = jobs.submit(build_worklist, design_pipeline(file_digest, df), *job_params, key=job_key)
+        session.doe_job = jobs.get(job_id)
+        session.doe_job_key = job_key
+    job = session.doe_job
+
+    if not job.finished:
+        plates = f"{job.plates_done} / {job.plates_total} plates" if job.plates_total else "starting"
+        st.progress(job.fraction_done, text=f"Generating iDOT file... {plates}")
+        time.sleep(0.5)
+        st.rerun()
+    elif job.state == 'failed':
+        st.error(f"Conversion failed: {job.error}")
+    else:
+        finished_path, run_time = job.result
+        try:
+            with open(finished_path, 'rb') as finished_file:
+                finished_worklist = finished_file.read()
+        except FileNotFoundError:
+            # the job was forgotten (and its file deleted) since it finished, convert again
+            session.doe_job = None
+            st.rerun()
+        st.metric("Estimated iDOT run time", f"{run_time / 60:.1f} min")
+
+        download_button = st.download_button(
+            label="Download finished file",
+            data=finished_worklist,
+            file_name=destination_name,
+            mime="text/csv"
+        )
 
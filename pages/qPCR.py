@@ -1,7 +1,38 @@
+import io
+from pathlib import Path
+
 import streamlit as st
 
 import to_idot
 
+
+# the finished files are cached on the template's path and modification time plus the assay parameters (arguments
+# starting with _ are not hashed by streamlit), shared by every session and the least recently used entries are dropped once full
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_qpcr_worklist(template_keys, dna_volume, primer_volume, final_volume_without_master_mix, number_primer_tubes, _templates):
+    """
+    Converts the qPCR templates into one iDOT file, a target plate per template sharing the source plate
+    :param template_keys: tuple of the (path, mtime) of each template file
+    :param _templates: list of the parsed templates (to_idot.QpcrTemplate)
+    :return: the finished iDOT file as a string
+    """
+    finished_file = io.StringIO()
+    to_idot.qPCR_to_idot_main(_templates, finished_file, dna_volume, primer_volume, final_volume_without_master_mix, number_primer_tubes)
+    return finished_file.getvalue()
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_cfx_template(template_key, _template):
+    """
+    Converts the qPCR template into the CFX plate template
+    :param template_key: (path, mtime) of the template file
+    :param _template: the parsed template (to_idot.QpcrTemplate)
+    :return: the CFX plate template as a string
+    """
+    finished_file = io.StringIO()
+    to_idot.generate_csv_file(finished_file, to_idot.plate_template_gen(_template), idot_header=False)
+    return finished_file.getvalue()
+
 #from st_aggrid import AgGrid, GridOptionsBuilder
 
 st.set_page_config(layout="wide")
@@ -11,7 +42,7 @@ st.title("Welcome to the qPCR setup page")
 container = st.container()
 st.sidebar.header("Assay parameters")
 options_form = st.sidebar.form("Options Form")
-source_path = st.text_input("Path to excel template")
+source_paths = st.text_area("Path to excel template (one per line to plate several in one iDOT run)")
 with_idot_choice = st.checkbox('Plate with the iDot?')
 target_path = st.text_input("Path for idot file")
 dna_volume = options_form.text_input("Volume of DNA in reaction", value = 1)
@@ -26,10 +57,16 @@ CFX_choice = st.checkbox('Create a CFX plate template file?')
 target_path_plate = st.text_input("Path for CFX file")
 submit_sidebar = options_form.form_submit_button()
 if submit_sidebar:
-    path = source_path
+    source_paths = [path.strip() for path in source_paths.splitlines() if path.strip()]
+    # each workbook is parsed once (and again only after the file is saved), both outputs are built from it
+    templates = [to_idot.load_qpcr_template(path) for path in source_paths]
     if with_idot_choice:
-        df = to_idot.qPCR_to_idot_main(path, target_path, dna_volume, primer_volume, final_reaction_volume/2, number_primer_tubes)
+        with open(target_path, 'w', newline='') as idot_file:
+            idot_file.write(build_qpcr_worklist(tuple(template.key for template in templates), dna_volume, primer_volume, final_reaction_volume/2, number_primer_tubes, templates))
     if CFX_choice:
-        df = to_idot.plate_template_gen(path)
-        to_idot.generate_csv_file(target_path_plate, df, idot_header=False)
-    
+        cfx_path = Path(target_path_plate)
+        for source, template in zip(source_paths, templates):
+            # one CFX file per plate, named after its template when there are several
+            plate_path = cfx_path if len(templates) == 1 else cfx_path.with_name(f'{cfx_path.stem}_{Path(source).stem}{cfx_path.suffix}')
+            with open(plate_path, 'w', newline='') as cfx_file:
+                cfx_file.write(build_cfx_template(template.key, template))
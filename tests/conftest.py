@@ -0,0 +1,29 @@
+import csv
+import io
+import re
+
+import pandas as pd
+import pytest
+
+WELL = re.compile(r'^[A-Z]+\d+$')
+
+
+def _read_dispenses(text):
+    """
+    The dispenses of an iDOT .csv, one row each with the target plate and source plate of the block it is in
+    """
+    rows = []
+    target_plate = source_plate = None
+    for row in csv.reader(io.StringIO(text)):
+        if len(row) > 5 and row[1].startswith('Source Plate '):
+            source_plate = int(row[1].split()[-1])
+            target_plate = int(row[5])
+        elif len(row) > 3 and WELL.match(row[0]) and WELL.match(row[1]):
+            rows.append({'Target Plate': target_plate, 'Source Plate': source_plate, 'Source Well': row[0],
+                         'Target Well': row[1], 'Volume [ul]': float(row[2]), 'Liquid Name': row[3]})
+    return pd.DataFrame(rows, columns=['Target Plate', 'Source Plate', 'Source Well', 'Target Well', 'Volume [ul]', 'Liquid Name'])
+
+
+@pytest.fixture
+def read_dispenses():
+    return _read_dispenses
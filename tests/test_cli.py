@@ -0,0 +1,86 @@
+import io
+import json
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from to_idot.cli import find_designs, main, read_stock_manifest
+from to_idot.doe_to_idot import doe_to_idot_main
+
+TEST_DESIGN = Path(__file__).parent.parent / 'test_data' / 'doe.csv'
+STOCKS = {'ITS (X)': 10, 'DEX (uM)': 1, 'LASC (mM)': 100, 'TGF-B1 (ng/mL)': 100, 'N2 (X)': 10, 'B27 (X)': 10}
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    path = tmp_path / 'stocks.json'
+    path.write_text(json.dumps(STOCKS))
+    return str(path)
+
+
+@pytest.mark.parametrize('header', ['', 'reagent,concentration\n'])
+def test_csv_manifest_with_or_without_header(tmp_path, header):
+    path = tmp_path / 'stocks.csv'
+    path.write_text(header + ''.join(f'{name},{conc}\n' for name, conc in STOCKS.items()))
+    assert read_stock_manifest(path) == STOCKS
+
+
+def test_toml_manifest(tmp_path):
+    path = tmp_path / 'stocks.toml'
+    path.write_text(''.join(f'"{name}" = {conc}\n' for name, conc in STOCKS.items()))
+    assert read_stock_manifest(path) == STOCKS
+
+
+def test_csv_manifest_rejects_bad_concentration(tmp_path):
+    path = tmp_path / 'stocks.csv'
+    path.write_text('ITS (X),10\nDEX (uM),lots\n')
+    with pytest.raises(ValueError):
+        read_stock_manifest(path)
+
+
+def test_find_designs_in_directories_and_globs(tmp_path):
+    for name in ['a.csv', 'b.xlsx', 'notes.txt', 'sub/c.parquet']:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+    assert find_designs([str(tmp_path)]) == [tmp_path / 'a.csv', tmp_path / 'b.xlsx']
+    assert find_designs([str(tmp_path / '**' / '*.parquet'), str(tmp_path / 'a.csv')]) == [tmp_path / 'a.csv', tmp_path / 'sub' / 'c.parquet']
+
+
+def test_converts_every_design(tmp_path, manifest):
+    designs = tmp_path / 'designs'
+    designs.mkdir()
+    shutil.copy(TEST_DESIGN, designs / 'first.csv')
+    shutil.copy(TEST_DESIGN, designs / 'second.csv')
+    summary = tmp_path / 'summary.json'
+    status = main([str(designs), '--stocks', manifest, '--final-volume', '30', '--output-dir', str(tmp_path / 'out'), '--workers', '1', '--summary', str(summary)])
+    assert status == 0
+    expected = io.StringIO()
+    doe_to_idot_main(pd.read_csv(TEST_DESIGN, encoding='utf-8-sig'), 30, STOCKS, expected)
+    for name in ['first', 'second']:
+        assert (tmp_path / 'out' / f'{name}-idot.csv').read_bytes().decode() == expected.getvalue()
+    report = json.loads(summary.read_text())
+    assert len(report['converted']) == 2 and report['failed'] == []
+    assert not list((tmp_path / 'out').glob('*.part'))
+
+
+def test_failed_design_reported_and_others_written(tmp_path, manifest):
+    shutil.copy(TEST_DESIGN, tmp_path / 'good.csv')
+    pd.DataFrame({'unknown reagent': [1.0, 2.0]}).to_csv(tmp_path / 'bad.csv', index=False)
+    status = main([str(tmp_path), '--stocks', manifest, '--final-volume', '30', '--workers', '1'])
+    assert status == 1
+    assert (tmp_path / 'good-idot.csv').exists()
+    assert not (tmp_path / 'bad-idot.csv').exists()
+
+
+@pytest.mark.parametrize('names', [['x/run.csv', 'y/run.csv'], ['run.csv', 'run.xlsx']])
+def test_designs_writing_the_same_file_rejected(tmp_path, manifest, capsys, names):
+    for name in names:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        shutil.copy(TEST_DESIGN, tmp_path / name)
+    with pytest.raises(SystemExit) as exit_info:
+        main([str((tmp_path / name).parent) for name in names] + ['--stocks', manifest, '--final-volume', '30', '--output-dir', str(tmp_path / 'out'), '--workers', '1'])
+    assert exit_info.value.code == 2
+    assert 'same iDOT file' in capsys.readouterr().err
+    assert not (tmp_path / 'out').exists()
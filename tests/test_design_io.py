@@ -0,0 +1,55 @@
+import io
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from to_idot.design_io import read_design, sniff_format
+
+TEST_DESIGN = Path(__file__).parent.parent / 'test_data' / 'doe.csv'
+
+
+@pytest.mark.parametrize('head, file_format', [
+    (b'PAR1\x15\x04', 'parquet'),
+    (b'ARROW1\x00\x00', 'feather'),
+    (b'PK\x03\x04\x14\x00', 'excel'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1', 'excel'),
+    (b'\xef\xbb\xbfITS (X)', 'csv'),
+    (b'A,B\n1,2', 'csv'),
+    (b'', 'csv'),
+])
+def test_sniff_format(head, file_format):
+    assert sniff_format(head) == file_format
+
+
+@pytest.fixture
+def design():
+    return pd.read_csv(TEST_DESIGN, encoding='utf-8-sig')
+
+
+@pytest.mark.parametrize('write', [
+    lambda df, buffer: df.to_csv(buffer, index=False),
+    lambda df, buffer: df.to_excel(buffer, index=False),
+    lambda df, buffer: df.to_parquet(buffer, index=False),
+    lambda df, buffer: df.to_feather(buffer),
+])
+def test_every_format_reads_the_same_design(design, write):
+    buffer = io.BytesIO()
+    write(design, buffer)
+    # bytes (as stored) and a file object (as uploaded)
+    pd.testing.assert_frame_equal(read_design(buffer.getvalue()), design, check_dtype=False)
+    pd.testing.assert_frame_equal(read_design(io.BytesIO(buffer.getvalue())), design, check_dtype=False)
+
+
+def test_csv_path_with_byte_order_mark(design):
+    pd.testing.assert_frame_equal(read_design(TEST_DESIGN), design)
+    pd.testing.assert_frame_equal(read_design(str(TEST_DESIGN)), design)
+
+
+def test_blank_header_named_like_pandas(design):
+    # the index column of a csv exported with its index has a blank header
+    buffer = io.BytesIO()
+    design.to_csv(buffer)
+    df = read_design(buffer.getvalue())
+    assert list(df.columns) == list(pd.read_csv(io.BytesIO(buffer.getvalue())).columns)
+    assert df.columns[0] == 'Unnamed: 0'
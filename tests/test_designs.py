@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from to_idot import CentralComposite, FractionalFactorial, FullFactorial, LatinHypercube
+
+DESIGNS = [
+    FullFactorial({'A': [0, 1, 2], 'B': [0.5, 1], 'C': [0, 0.25, 3, 4]}),
+    FractionalFactorial({'A': (0, 1), 'B': (1, 2), 'C': (0, 4), 'D': (2, 3), 'E': (0, 1)}, {'E': ('A', 'B', 'C')}),
+    CentralComposite({'A': (1, 3), 'B': (1, 2), 'C': (2, 6)}, alpha=1.5, centre_points=4),
+    LatinHypercube({'A': (0, 5), 'B': (0.1, 1)}, n_samples=101, seed=7),
+]
+
+
+@pytest.mark.parametrize('design', DESIGNS)
+@pytest.mark.parametrize('batch_size', [1, 7, 96, 1000])
+def test_to_frame_matches_streamed_rows(design, batch_size):
+    frame = design.to_frame()
+    streamed = pd.concat(list(design.batches(batch_size)))
+    assert list(frame.columns) == list(design.columns)
+    assert len(frame) == len(design)
+    pd.testing.assert_frame_equal(streamed, frame)
+    np.testing.assert_array_equal(np.array(list(design)), frame.to_numpy())
+
+
+def test_full_factorial_has_every_combination_once():
+    design = DESIGNS[0]
+    frame = design.to_frame()
+    assert not frame.duplicated().any()
+    assert len(frame) == 3 * 2 * 4
+
+
+def test_latin_hypercube_uses_every_stratum_once():
+    design = DESIGNS[3]
+    frame = design.to_frame()
+    for name, (low, high) in design.factors.items():
+        strata = np.floor((frame[name] - low) / (high - low) * design.n_samples).astype(int)
+        assert sorted(strata) == list(range(design.n_samples))
+
+
+def test_design_is_abstract():
+    from to_idot.designs import Design
+    with pytest.raises(TypeError):
+        Design()
@@ -0,0 +1,73 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from to_idot.dispense_plan import InstrumentModel, estimate_plate_time, estimate_run_time, optimize_dispense_order, optimize_worklists
+from to_idot.doe_to_idot import doe_to_idot_main, generate_target_vols, get_source_wells
+from to_idot.source_plan import SourcePlateType
+
+TEST_DESIGN = Path(__file__).parent.parent / 'test_data' / 'doe.csv'
+STOCKS = {'ITS (X)': 10, 'DEX (uM)': 1, 'LASC (mM)': 100, 'TGF-B1 (ng/mL)': 100, 'N2 (X)': 10, 'B27 (X)': 10}
+MODELS = [InstrumentModel(), InstrumentModel(channels=1), InstrumentModel(source_switch_s=0, per_dispense_s=1, channels=3)]
+
+
+def worklists(replicates=3, source_plate=None):
+    plates, _ = generate_target_vols(pd.read_csv(TEST_DESIGN, encoding='utf-8-sig'), 100, STOCKS, replicates=replicates)
+    return get_source_wells(plates, source_plate=source_plate)
+
+
+def rows(worklist):
+    return worklist.astype(str).sort_values(list(worklist.columns)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('model', MODELS)
+@pytest.mark.parametrize('seed', [None, 0, 1])
+def test_never_slower_and_same_dispenses(model, seed):
+    # 20 ul of dead volume spreads the reagents over more wells and source plates
+    for worklist in worklists(source_plate=SourcePlateType(dead_volume_pl=20 * 10 ** 6)):
+        if seed is not None:
+            worklist = worklist.sample(frac=1, random_state=seed)
+        optimized = optimize_dispense_order(worklist, model)
+        assert estimate_plate_time(optimized, model) <= estimate_plate_time(worklist, model)
+        pd.testing.assert_frame_equal(rows(optimized), rows(worklist))
+
+
+def test_each_source_well_visited_once_in_order():
+    worklist = worklists(replicates=1)[0].sample(frac=1, random_state=2).reset_index(drop=True)
+    worklist['order'] = np.arange(len(worklist))
+    optimized = optimize_dispense_order(worklist)
+    wells = list(zip(optimized['Source Plate'], optimized['Source Well']))
+    runs = [well for i, well in enumerate(wells) if i == 0 or well != wells[i - 1]]
+    assert len(runs) == len(set(wells))
+    for _, well_rows in optimized.groupby(['Source Plate', 'Source Well'], observed=True):
+        assert well_rows['order'].is_monotonic_increasing
+    # the source plates stay in order, as they are written to the .csv
+    assert optimized['Source Plate'].is_monotonic_increasing
+
+
+def test_empty_worklist():
+    empty = worklists()[0].iloc[:0]
+    assert len(optimize_dispense_order(empty)) == 0
+    assert estimate_plate_time(empty) == 0
+
+
+def test_run_time_counts_plate_changes():
+    plates = worklists()
+    model = InstrumentModel()
+    assert estimate_run_time(plates, model) == pytest.approx(sum(estimate_plate_time(plate, model) for plate in plates) + len(plates) * model.plate_change_s)
+    assert estimate_run_time(optimize_worklists(plates, model), model) <= estimate_run_time(plates, model)
+
+
+def test_optimized_run_dispenses_the_same(read_dispenses):
+    design = pd.read_csv(TEST_DESIGN, encoding='utf-8-sig')
+    files = {}
+    run_times = {}
+    for optimize_order in (False, True):
+        buffer = io.StringIO()
+        run_times[optimize_order] = doe_to_idot_main(design, 100, STOCKS, buffer, replicates=3, optimize_order=optimize_order)
+        files[optimize_order] = read_dispenses(buffer.getvalue())
+    assert run_times[True] <= run_times[False]
+    pd.testing.assert_frame_equal(rows(files[True]), rows(files[False]))
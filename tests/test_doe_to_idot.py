@@ -0,0 +1,106 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from to_idot import FullFactorial, LatinHypercube, SourcePlateType
+from to_idot.doe_to_idot import calculate_target_well_info_per_df, doe_to_idot_main, unique_conditions
+from to_idot.units import PL_PER_UL
+
+UL = PL_PER_UL
+TEST_DESIGN = Path(__file__).parent.parent / 'test_data' / 'doe.csv'
+STOCKS = {'ITS (X)': 10, 'DEX (uM)': 1, 'LASC (mM)': 100, 'TGF-B1 (ng/mL)': 100, 'N2 (X)': 10, 'B27 (X)': 10}
+
+
+def convert(design, stocks, final_volume=30, **kwargs):
+    buffer = io.StringIO()
+    run_time = doe_to_idot_main(design, final_volume, stocks, buffer, **kwargs)
+    return buffer.getvalue(), run_time
+
+
+@pytest.mark.parametrize('source_plate', [None, SourcePlateType(dead_volume_pl=15 * UL)])
+def test_source_wells_within_volume_and_one_reagent_each(read_dispenses, source_plate):
+    design = pd.read_csv(TEST_DESIGN, encoding='utf-8-sig')
+    text, _ = convert(design, STOCKS, final_volume=100, replicates=3, source_plate=source_plate)
+    dispenses = read_dispenses(text)
+    usable_ul = (source_plate or SourcePlateType()).usable_volume_pl / UL
+    by_well = dispenses.groupby(['Source Plate', 'Source Well'])
+    assert by_well['Volume [ul]'].sum().max() <= usable_ul
+    assert (by_well['Liquid Name'].nunique() == 1).all()
+    # every condition gets every reagent it needs, 160 conditions in triplicate
+    assert dispenses.groupby(['Target Plate', 'Target Well']).ngroups == 480
+
+
+def test_dispense_past_usable_volume_rejected():
+    design = pd.read_csv(TEST_DESIGN, encoding='utf-8-sig')
+    with pytest.raises(ValueError):
+        convert(design, STOCKS, final_volume=100, source_plate=SourcePlateType(dead_volume_pl=75 * UL))
+
+
+@pytest.mark.parametrize('design', [
+    FullFactorial({'A': [0, 1, 2, 5], 'B': [0.5, 1], 'C': [0, 0.25, 3], 'D': [1, 4, 8]}),
+    LatinHypercube({'A': (0, 5), 'B': (0.1, 1), 'C': (0, 8)}, n_samples=250, seed=3),
+])
+@pytest.mark.parametrize('orientation', ['by_columns', 'by_rows'])
+def test_streamed_design_matches_in_memory(design, orientation):
+    stocks = {name: 40 for name in design.columns}
+    streamed = convert(design, stocks, replicates=2, orientation=orientation)
+    in_memory = convert(design.to_frame(), stocks, replicates=2, orientation=orientation)
+    assert streamed[0] == in_memory[0]
+    assert streamed[1] == pytest.approx(in_memory[1])
+
+
+def plate_of(volumes_pl):
+    return pd.DataFrame({'reagent': np.asarray(volumes_pl, dtype=np.int64), 'Well': [f'A{i + 1}' for i in range(len(volumes_pl))]})
+
+
+@pytest.mark.parametrize('volumes_pl, wells', [
+    ([0], 0),
+    ([80 * UL], 1),
+    ([80 * UL, 100], 2),
+    ([160 * UL], 2),
+    ([160 * UL, 100], 3),
+])
+def test_source_well_count_at_80_ul_boundary(volumes_pl, wells):
+    sums, counts = calculate_target_well_info_per_df([plate_of(volumes_pl)], 1)
+    assert sums == [{'reagent': sum(volumes_pl)}]
+    assert counts == [{'reagent': wells}]
+
+
+def test_source_well_count_uses_usable_volume():
+    _, counts = calculate_target_well_info_per_df([plate_of([80 * UL])], 1, SourcePlateType(dead_volume_pl=10 * UL))
+    assert counts == [{'reagent': 2}]
+
+
+def test_blank_concentration_rejected():
+    design = pd.read_csv(TEST_DESIGN, encoding='utf-8-sig')
+    design.iloc[3, 2] = np.nan
+    with pytest.raises(ValueError):
+        convert(design, STOCKS)
+
+
+@pytest.mark.filterwarnings('ignore:divide by zero')
+def test_zero_stock_concentration_rejected():
+    with pytest.raises(ValueError):
+        convert(pd.read_csv(TEST_DESIGN, encoding='utf-8-sig'), {**STOCKS, 'N2 (X)': 0})
+
+
+def test_plates_put_together_in_processes_match_serial():
+    design = pd.read_csv(TEST_DESIGN, encoding='utf-8-sig')
+    done = []
+    parallel = convert(design, STOCKS, final_volume=100, replicates=3, max_workers=2, progress=lambda plate, plates: done.append((plate, plates)))
+    assert parallel == convert(design, STOCKS, final_volume=100, replicates=3)
+    assert done == [(plate, 5) for plate in range(1, 6)]
+
+
+def test_unique_conditions_map_back_to_every_condition():
+    rng = np.random.default_rng(0)
+    distinct = rng.choice([0, 0.5, 1, 2], size=(20, 4))
+    concentrations = distinct[rng.integers(0, 20, size=500)]
+    unique, condition_rows = unique_conditions(concentrations)
+    np.testing.assert_array_equal(unique[condition_rows], concentrations)
+    assert len(unique) == len(np.unique(concentrations, axis=0))
+    # in the order they first appear
+    np.testing.assert_array_equal(unique[0], concentrations[0])
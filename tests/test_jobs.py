@@ -0,0 +1,95 @@
+import threading
+import time
+
+from to_idot.jobs import JobExecutor
+
+
+def wait(executor, job_id):
+    job = executor.get(job_id)
+    job._future.result(timeout=10)
+    return job
+
+
+def convert(value, progress):
+    progress(1, 1)
+    return value
+
+
+def blocked(event, progress):
+    # reports progress until the event is set, like a conversion going plate by plate
+    while not event.wait(0.01):
+        progress(0, 1)
+    progress(1, 1)
+    return 'finished'
+
+
+def test_same_key_shares_one_job():
+    executor = JobExecutor(max_workers=1)
+    first = executor.submit(convert, 1, key='a')
+    assert executor.submit(convert, 2, key='a') == first
+    assert wait(executor, first).result == 1
+    # still remembered once finished
+    assert executor.submit(convert, 3, key='a') == first
+    assert executor.submit(convert, 4, key='b') != first
+    executor.shutdown()
+
+
+def test_oldest_finished_jobs_forgotten_and_discarded():
+    discarded = []
+    executor = JobExecutor(max_workers=1, max_finished=2, discard=discarded.append)
+    # the first job holds the only worker until the rest are queued
+    release = threading.Event()
+    gate = executor.submit(blocked, release, key='gate')
+    job_ids = [executor.submit(convert, value, key=value) for value in range(3)]
+    jobs = [executor.get(job_id) for job_id in [gate] + job_ids]
+    release.set()
+    for job in jobs:
+        job._future.result(timeout=10)
+    assert [executor.get(job.id) is None for job in jobs] == [True, True, False, False]
+    assert discarded == ['finished', 0]
+    # a forgotten key runs again
+    assert executor.submit(convert, 0, key=0) != job_ids[0]
+    executor.shutdown()
+
+
+def test_failed_job_kept_with_its_error_and_retried():
+    def fail(progress):
+        raise ValueError('bad stock')
+    executor = JobExecutor(max_workers=1)
+    job_id = executor.submit(fail, key='a')
+    job = wait(executor, job_id)
+    assert job.state == 'failed' and isinstance(job.error, ValueError)
+    assert executor.submit(convert, 1, key='a') != job_id
+    executor.shutdown()
+
+
+def test_cancel_stops_running_and_queued_jobs():
+    executor = JobExecutor(max_workers=1)
+    release = threading.Event()
+    running = executor.submit(blocked, release, key='running')
+    queued = executor.submit(convert, 1, key='queued')
+    running_job, queued_job = executor.get(running), executor.get(queued)
+    while running_job.state != 'running':
+        time.sleep(0.001)
+    assert executor.cancel(queued)
+    assert executor.cancel(running)
+    running_job._future.result(timeout=10)
+    assert running_job.state == 'cancelled' and running_job.result is None
+    assert queued_job._future.cancelled()
+    assert executor.get(running) is None and executor.get(queued) is None
+    executor.shutdown()
+
+
+def test_cancel_waits_for_every_holder():
+    executor = JobExecutor(max_workers=1)
+    release = threading.Event()
+    job_id = executor.submit(blocked, release, key='a')
+    # another session asked for the same conversion
+    assert executor.submit(blocked, release, key='a') == job_id
+    assert not executor.cancel(job_id)
+    release.set()
+    assert wait(executor, job_id).result == 'finished'
+    # finished jobs are kept for the next submit
+    assert not executor.cancel(job_id)
+    assert executor.get(job_id).state == 'done'
+    executor.shutdown()
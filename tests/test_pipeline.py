@@ -0,0 +1,74 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from to_idot import DoePipeline, SourcePlateType
+from to_idot.doe_to_idot import doe_to_idot_main
+
+TEST_DESIGN = Path(__file__).parent.parent / 'test_data' / 'doe.csv'
+STOCKS = {'ITS (X)': 10, 'DEX (uM)': 1, 'LASC (mM)': 100, 'TGF-B1 (ng/mL)': 100, 'N2 (X)': 10, 'B27 (X)': 10}
+
+# each change on top of the ones before it
+CHANGES = [
+    {'final_volume': 30, 'starting_conc_dict': STOCKS},
+    {'starting_conc_dict': {'DEX (uM)': 2}},
+    {'replicates': 3},
+    {'final_volume': 50, 'orientation': 'by_rows'},
+    {'starting_conc_dict': {'N2 (X)': 20, 'B27 (X)': 5}, 'plate_size': 384},
+    {'source_plate': SourcePlateType(dead_volume_pl=20 * 10 ** 6)},
+    {},
+]
+
+
+def repeated_design():
+    # the test design repeats about half its conditions
+    return pd.read_csv(TEST_DESIGN, encoding='utf-8-sig')
+
+
+def distinct_design():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(rng.uniform(0.1, 1, size=(300, len(STOCKS))), columns=list(STOCKS))
+
+
+@pytest.mark.parametrize('make_design', [repeated_design, distinct_design])
+def test_output_matches_main_after_every_change(make_design):
+    design = make_design()
+    pipeline = DoePipeline(design)
+    parameters = {'replicates': 1, 'orientation': 'by_columns', 'plate_size': 96, 'source_plate': None}
+    stocks = {}
+    for change in CHANGES:
+        stocks.update(change.get('starting_conc_dict', {}))
+        parameters.update({name: value for name, value in change.items() if name != 'starting_conc_dict'})
+        pipelined = io.StringIO()
+        run_time = pipeline.run(pipelined, **change)
+        expected = io.StringIO()
+        expected_run_time = doe_to_idot_main(design, starting_conc_dict=dict(stocks), final_csv_buffer=expected, **parameters)
+        assert pipelined.getvalue() == expected.getvalue()
+        assert run_time == pytest.approx(expected_run_time)
+
+
+def test_only_changed_reagents_worked_out_again():
+    pipeline = DoePipeline(repeated_design(), final_volume=30, starting_conc_dict=STOCKS)
+    pipeline.worklists()
+    assert pipeline.update(starting_conc_dict={'DEX (uM)': 2, 'ITS (X)': 10}) == {'DEX (uM)'}
+    assert pipeline.update(final_volume=40) == set(STOCKS)
+
+
+def test_unique_ratio():
+    assert DoePipeline(repeated_design()).unique_ratio == pytest.approx(77 / 160)
+    assert DoePipeline(distinct_design()).unique_ratio == 1.0
+
+
+def test_unknown_reagent_rejected():
+    pipeline = DoePipeline(repeated_design())
+    with pytest.raises(ValueError):
+        pipeline.update(starting_conc_dict={'not a reagent': 1})
+
+
+def test_missing_stock_rejected():
+    pipeline = DoePipeline(repeated_design(), final_volume=30, starting_conc_dict={'ITS (X)': 10})
+    with pytest.raises(ValueError):
+        pipeline.run(io.StringIO())
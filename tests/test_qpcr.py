@@ -0,0 +1,76 @@
+import io
+
+import pandas as pd
+import pytest
+
+from to_idot import qPCR_to_idot_main
+from to_idot.qPCR_to_idot import generate_df_from_templates
+
+DNA_VOLUME = 1
+PRIMER_VOLUME = 2
+FINAL_VOLUME = 5
+
+
+def write_template(path, wells):
+    """
+    A qPCR excel template, wells is a list of (well, group, target, dilution)
+    """
+    pd.DataFrame(wells, columns=['Wells', 'Group', 'Target', 'Dilution']).to_excel(path, sheet_name='Sheet1', index=False)
+    return str(path)
+
+
+@pytest.fixture
+def templates(tmp_path):
+    first = write_template(tmp_path / 'plate1.xlsx', [
+        ('A1', 'S1', 'OCT4', 1), ('A2', 'S1', 'SOX2', 2), ('A3', 'S2', 'OCT4', 1), ('A4', 'NTC', 'OCT4', 1), ('A5', None, None, None),
+    ])
+    second = write_template(tmp_path / 'plate2.xlsx', [
+        ('A1', 'S3', 'NANOG', 1), ('A2', 'S1', 'OCT4', 1), ('B1', 'S1', 'NANOG', 5),
+    ])
+    return [first, second]
+
+
+def run(templates, primer_tubes=1):
+    buffer = io.StringIO()
+    qPCR_to_idot_main(templates, buffer, DNA_VOLUME, PRIMER_VOLUME, FINAL_VOLUME, primer_tubes)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('primer_tubes', [1, 2])
+def test_templates_share_one_set_of_columns(templates, primer_tubes):
+    plates, _ = generate_df_from_templates(templates, DNA_VOLUME, PRIMER_VOLUME, FINAL_VOLUME, primer_tubes)
+    assert len(plates) == 2
+    assert list(plates[0].columns) == list(plates[1].columns)
+    assert [len(plate) for plate in plates] == [4, 3]
+    reagents = [column for column in plates[0].columns if column != 'Well']
+    targets = ['OCT4', 'SOX2', 'NANOG'] if primer_tubes == 1 else ['OCT4_1', 'OCT4_2', 'SOX2_1', 'SOX2_2', 'NANOG_1', 'NANOG_2']
+    assert reagents == ['S1', 'S2', 'NTC', 'S3'] + targets + ['water']
+
+
+def test_shared_reagents_pooled_over_plates(read_dispenses, templates):
+    dispenses = read_dispenses(run(templates))
+    assert sorted(dispenses['Target Plate'].unique()) == [1, 2]
+    # a reagent used on both plates is drawn from the same source well, no well holds two reagents
+    wells = dispenses.groupby('Liquid Name')['Source Well'].unique()
+    for reagent in ['S1', 'OCT4', 'NANOG', 'water']:
+        assert len(wells[reagent]) == 1
+    assert dispenses.groupby('Source Well')['Liquid Name'].nunique().max() == 1
+    # the second plate's water comes out of the first plate's water well rather than a new one
+    plate_wells = dispenses[dispenses['Liquid Name'] == 'water'].groupby('Target Plate')['Source Well'].unique()
+    assert list(plate_wells[1]) == list(plate_wells[2])
+
+
+def test_pooled_run_matches_separate_runs(read_dispenses, templates):
+    pooled = read_dispenses(run(templates))
+    separate = pd.concat([read_dispenses(run(template)).assign(**{'Target Plate': plate}) for plate, template in enumerate(templates, 1)])
+    columns = ['Target Plate', 'Target Well', 'Liquid Name', 'Volume [ul]']
+    pd.testing.assert_frame_equal(
+        pooled[columns].sort_values(columns).reset_index(drop=True),
+        separate[columns].sort_values(columns).reset_index(drop=True),
+    )
+    # a DNA group or primer on both plates is loaded once, so pooling never takes more source wells
+    assert pooled['Source Well'].nunique() < separate.groupby('Target Plate')['Source Well'].nunique().sum()
+
+
+def test_single_template_same_as_list_of_one(templates):
+    assert run(templates[0]) == run([templates[0]])
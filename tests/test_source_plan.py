@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from to_idot.source_plan import SourcePlateType, continue_source_wells, plan_source_wells, split_source_wells
+from to_idot.units import PL_PER_UL, to_picolitres
+
+UL = PL_PER_UL
+
+
+def random_volumes(seed, n_reagents=6, n_wells=2000):
+    # mostly small dispenses, some large, with wells the reagent isn't added to
+    rng = np.random.default_rng(seed)
+    volumes = to_picolitres(rng.choice([0, 0, 0.05, 0.5, 2, 7.5, 30], size=(n_reagents, n_wells)))
+    return list(volumes)
+
+
+@pytest.mark.parametrize('plate_type', [SourcePlateType(), SourcePlateType(dead_volume_pl=10 * UL), SourcePlateType(well_volume_pl=60 * UL, dead_volume_pl=5 * UL, n_wells=384)])
+def test_draws_per_source_well_within_usable_volume(plate_type):
+    allocations = plan_source_wells(random_volumes(0), plate_type)
+    for allocation in allocations:
+        rows, volumes, source_wells = allocation
+        drawn = np.bincount(source_wells - source_wells[0], weights=volumes)
+        assert drawn.max() <= plate_type.usable_volume_pl
+
+
+def test_no_source_well_holds_two_reagents():
+    # enough volume that the reagents spill over more than one 96 well source plate
+    allocations = plan_source_wells(random_volumes(1, n_reagents=12, n_wells=20000))
+    wells = [set(allocation[2].tolist()) for allocation in allocations]
+    assert len(set().union(*wells)) == sum(len(reagent_wells) for reagent_wells in wells)
+    assert max(max(reagent_wells) for reagent_wells in wells) >= 96
+
+
+def test_unused_reagent_gets_no_wells():
+    allocations = plan_source_wells([np.zeros(10, dtype=np.int64), np.full(10, UL)])
+    assert allocations[0] is None
+    assert allocations[1][2].tolist() == [0] * 10
+
+
+def test_split_in_batches_matches_split_in_one_go():
+    volumes = random_volumes(2, n_reagents=1)[0]
+    volumes = volumes[volumes != 0]
+    state = None
+    offsets = []
+    for batch in np.array_split(volumes, 7):
+        batch_offsets, state = continue_source_wells(batch, 80 * UL, state)
+        offsets.append(batch_offsets)
+    np.testing.assert_array_equal(np.concatenate(offsets), split_source_wells(volumes, 80 * UL))
+
+
+def test_single_full_well_dispense_uses_one_source_well():
+    np.testing.assert_array_equal(split_source_wells([80 * UL]), [0])
+    np.testing.assert_array_equal(split_source_wells([80 * UL, 100]), [0, 1])
+
+
+def test_dispense_larger_than_a_well_rejected():
+    with pytest.raises(ValueError):
+        split_source_wells([UL, 100 * UL])
+    with pytest.raises(ValueError):
+        continue_source_wells([6 * UL], 5 * UL, state=(0, UL))
+    # 75 ul dead volume leaves 5 ul to dispense from each well
+    with pytest.raises(ValueError):
+        plan_source_wells([np.full(10, UL), np.array([0, 10 * UL])], SourcePlateType(dead_volume_pl=75 * UL))
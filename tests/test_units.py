@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from to_idot.units import PL_PER_UL, to_microlitres, to_picolitres
+
+
+@pytest.mark.parametrize('volumes_ul', [[1.0, np.nan], [np.inf], [-np.inf, 2.0]])
+def test_non_finite_volumes_rejected(volumes_ul):
+    with pytest.raises(ValueError):
+        to_picolitres(np.asarray(volumes_ul))
+
+
+def test_volumes_kept_to_a_tenth_of_a_nanolitre():
+    np.testing.assert_array_equal(to_picolitres(np.array([0.0192, 0.0025, 12.34567])), [19200, 2500, 12345700])
+
+
+def test_round_trip_to_microlitres():
+    volumes_ul = np.array([0, 0.0001, 1.5, 79.9999])
+    np.testing.assert_array_equal(to_microlitres(to_picolitres(volumes_ul)), volumes_ul)
+    assert to_picolitres(np.array([1.0])).dtype == np.int64
+    assert to_picolitres(np.array([1.0]))[0] == PL_PER_UL
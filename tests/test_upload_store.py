@@ -0,0 +1,92 @@
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from to_idot import UploadStore
+
+TEST_DESIGN = Path(__file__).parent.parent / 'test_data' / 'doe.csv'
+
+
+def upload(variant=0):
+    # the same design with a different trailing row, so each variant hashes differently
+    return TEST_DESIGN.read_bytes() + f'{variant},0,0,0,0,0\n'.encode()
+
+
+def test_same_bytes_stored_once(tmp_path):
+    store = UploadStore(tmp_path)
+    digest, df = store.get_or_put(upload())
+    assert store.put(upload()) == digest
+    assert len(list(tmp_path.glob('*.feather'))) == 1
+    expected = pd.read_csv(TEST_DESIGN, encoding='utf-8-sig')
+    np.testing.assert_array_equal(df.to_numpy()[:-1], expected.to_numpy())
+    assert list(df.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(store.get(digest), df)
+
+
+def test_numeric_columns_memory_mapped_read_only(tmp_path):
+    store = UploadStore(tmp_path)
+    _, df = store.get_or_put(upload())
+    column = df.iloc[:, 0].to_numpy()
+    assert not column.flags.writeable
+
+
+def test_least_recently_used_evicted_past_the_cap(tmp_path):
+    store = UploadStore(tmp_path, max_bytes=1)
+    first = store.put(upload(1))
+    second = store.put(upload(2))
+    # the newest is always kept, even on its own past the cap
+    assert first not in store and second in store
+    assert [path.stem for path in tmp_path.glob('*.feather')] == [second]
+    with pytest.raises(KeyError):
+        store.get(first)
+    # get_or_put stores it again
+    digest, df = store.get_or_put(upload(1))
+    assert digest == first and first in store and second not in store
+    assert len(df) == 161
+
+
+def test_eviction_follows_use_not_age(tmp_path):
+    store = UploadStore(tmp_path)
+    digests = [store.put(upload(variant)) for variant in range(3)]
+    store.max_bytes = store.total_bytes
+    # the oldest upload was read most recently, so the second one goes
+    store.get(digests[0])
+    store.put(upload(3))
+    assert [digest in store for digest in digests] == [True, False, True]
+
+
+def test_designs_already_on_disk_picked_up(tmp_path):
+    digest = UploadStore(tmp_path).put(upload())
+    store = UploadStore(tmp_path)
+    assert digest in store
+    assert len(store.get(digest)) == 161
+
+
+def test_evicted_file_stays_readable_while_open(tmp_path):
+    store = UploadStore(tmp_path, max_bytes=1)
+    _, df = store.get_or_put(upload(1))
+    store.put(upload(2))
+    assert df.iloc[:, 1].sum() > 0
+
+
+def test_get_or_put_while_other_sessions_evict(tmp_path):
+    store = UploadStore(tmp_path, max_bytes=1)
+    errors = []
+
+    def session(variant):
+        try:
+            for _ in range(20):
+                _, df = store.get_or_put(upload(variant))
+                assert len(df) == 161
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=session, args=(variant,)) for variant in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
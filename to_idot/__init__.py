@@ -1 +1,12 @@
-from .doe_to_idot import doe_to_idot_main, qPCR_to_idot_main, generate_csv_file, plate_template_gen
\ No newline at end of file
+from .doe_to_idot import doe_to_idot_main, generate_csv_file, iter_csv_chunks
+from .design_io import read_design
+from .designs import CentralComposite, FractionalFactorial, FullFactorial, LatinHypercube
+from .dispense_plan import InstrumentModel, estimate_run_time, optimize_worklists
+from .instrumentation import add_jsonl_sink, configure_from_env
+from .jobs import JobExecutor
+from .pipeline import DoePipeline
+from .source_plan import SourcePlateType, allocate_reagent, place_reagents, plan_source_wells, split_source_wells
+from .upload_store import UploadStore
+from .qPCR_to_idot import QpcrTemplate, load_qpcr_template, plate_template_gen, qPCR_to_idot_main, write_plate_templates
+
+configure_from_env()
@@ -0,0 +1,176 @@
+"""
+Command line batch conversion of DoE designs into iDOT files
+
+    python -m to_idot designs/ --stocks stocks.toml --final-volume 100 --output-dir idot_files/
+
+Every csv/xlsx/parquet/feather design found is converted in a pool of worker processes and written to its own iDOT .csv file.
+The stock manifest maps each reagent (column name in the designs) to its starting concentration, as a json or toml
+table or a two column csv (reagent, concentration). The units must match the ones used in the designs.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+import tomllib
+
+from .design_io import DESIGN_SUFFIXES, read_design
+from .doe_to_idot import doe_to_idot_main
+from .source_plan import SourcePlateType
+from .units import to_picolitres
+
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def read_stock_manifest(path):
+    """
+    Reads the starting (stock) concentration of every reagent
+    :param path: .json, .toml or .csv manifest (the csv may start with a header row)
+    :return: dictionary of reagent name to stock concentration
+    """
+    path = Path(path)
+    if path.suffix == '.json':
+        with open(path) as manifest:
+            stocks = json.load(manifest)
+    elif path.suffix == '.toml':
+        with open(path, 'rb') as manifest:
+            stocks = tomllib.load(manifest)
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as manifest:
+            rows = [row for row in csv.reader(manifest) if len(row) >= 2 and row[0]]
+        # a first row without a number in the concentration column is a header (e.g. reagent,concentration)
+        if rows and not _is_number(rows[0][1]):
+            rows = rows[1:]
+        stocks = {row[0]: row[1] for row in rows}
+    return {str(name): float(conc) for name, conc in stocks.items()}
+
+
+def find_designs(inputs):
+    """
+    Expands the command line inputs into a list of design files
+    :param inputs: list of files, directories (every design file inside) or glob patterns
+    :return: sorted list of paths, without duplicates
+    """
+    designs = set()
+    for pattern in inputs:
+        for match in (glob.glob(pattern, recursive=True) or [pattern]):
+            match = Path(match)
+            if match.is_dir():
+                designs.update(path for path in match.iterdir() if path.suffix.lower() in DESIGN_SUFFIXES)
+            elif match.suffix.lower() in DESIGN_SUFFIXES:
+                designs.add(match)
+    return sorted(designs)
+
+
+def convert_design(design_path, output_path, stocks, final_volume, replicates=1, orientation='by_columns', plate_size=96, optimize_order=False, source_plate=None):
+    """
+    Converts one design file into an iDOT file, run in the worker processes
+    :return: dictionary summarising the conversion
+    """
+    start = time.perf_counter()
+    in_df = read_design(design_path)
+    reagents = [col for col in in_df.columns if col != 'Unnamed: 0']
+    missing = [col for col in reagents if col not in stocks]
+    if missing:
+        raise ValueError(f'no stock concentration in the manifest for {missing}')
+    # only the reagents in this design, so one manifest can cover many designs
+    design_stocks = {col: stocks[col] for col in reagents}
+    # written next to the output first so a failed conversion never leaves a half written iDOT file behind
+    partial_path = Path(f'{output_path}.part')
+    try:
+        with open(partial_path, 'w', newline='') as out_file:
+            run_time = doe_to_idot_main(in_df, final_volume, design_stocks, out_file, replicates=replicates, orientation=orientation, plate_size=plate_size, optimize_order=optimize_order, source_plate=source_plate)
+        os.replace(partial_path, output_path)
+    finally:
+        partial_path.unlink(missing_ok=True)
+    return {
+        'design': str(design_path),
+        'output': str(output_path),
+        'conditions': len(in_df),
+        'seconds': round(time.perf_counter() - start, 4),
+        'estimated_run_seconds': round(run_time, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m to_idot',
+        description='translates simple DOE matrices in CSV or XLSX format into a CSV format that the iDOT by Dispendix can read',
+        epilog='Authored by Mark Owen, modified and maintained by Alex')
+    parser.add_argument('inputs', nargs='+', help='design files, directories or glob patterns (csv, xlsx, parquet or feather)')
+    parser.add_argument('--stocks', required=True, help='stock concentration manifest (.json, .toml or .csv)')
+    parser.add_argument('--final-volume', type=float, required=True, help='final volume in each well')
+    parser.add_argument('--replicates', type=int, default=1, help='number of replicates per condition')
+    parser.add_argument('--orientation', choices=['by_columns', 'by_rows'], default='by_columns')
+    parser.add_argument('--plate-size', type=int, choices=[96, 384, 1536], default=96, help='wells on each target plate')
+    parser.add_argument('--optimize-order', action='store_true', help='reorder the dispenses to shorten the run')
+    parser.add_argument('--source-plate-type', default='S.100 Plate', help='source plate type written in the iDOT header')
+    parser.add_argument('--source-well-volume', type=float, default=80, help='volume each source well is filled with, in ul')
+    parser.add_argument('--dead-volume', type=float, default=0, help='volume left in each source well that cannot be dispensed, in ul')
+    parser.add_argument('--source-plate-wells', type=int, choices=[96, 384, 1536], default=96, help='wells on each source plate')
+    parser.add_argument('--output-dir', help='where to write the iDOT files, next to each design by default')
+    parser.add_argument('--suffix', default='-idot.csv', help='added to the design name for the output file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--summary', help='write a json summary of the timings and failures to this file')
+    args = parser.parse_args(argv)
+
+    try:
+        stocks = read_stock_manifest(args.stocks)
+    except (OSError, ValueError, TypeError, AttributeError) as error:
+        parser.error(f'could not read the stock manifest {args.stocks}: {error}')
+    source_plate = SourcePlateType(args.source_plate_type, int(to_picolitres(args.source_well_volume)), int(to_picolitres(args.dead_volume)), args.source_plate_wells)
+    if source_plate.usable_volume_pl <= 0:
+        parser.error('the dead volume must be less than the source well volume')
+    designs = find_designs(args.inputs)
+    if not designs:
+        parser.error('no csv, xlsx, parquet or feather designs found')
+    output_paths = {design: (Path(args.output_dir) if args.output_dir else design.parent) / f'{design.stem}{args.suffix}' for design in designs}
+    # designs with the same name (e.g. x/run.csv and y/run.csv, or run.csv and run.xlsx) would write the same file
+    clashes = {}
+    for design, output_path in output_paths.items():
+        clashes.setdefault(os.path.normcase(os.path.abspath(output_path)), []).append(str(design))
+    clashes = {output_path: names for output_path, names in clashes.items() if len(names) > 1}
+    if clashes:
+        parser.error('several designs would be written to the same iDOT file, rename them: '
+                     + '; '.join(f"{', '.join(names)} -> {output_path}" for output_path, names in clashes.items()))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    results = []
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers or 1, len(designs)))) as pool:
+        futures = {}
+        for design, output_path in output_paths.items():
+            future = pool.submit(convert_design, design, output_path, stocks, args.final_volume, replicates=args.replicates, orientation=args.orientation, plate_size=args.plate_size, optimize_order=args.optimize_order, source_plate=source_plate)
+            futures[future] = design
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:
+                failures.append({'design': str(futures[future]), 'error': f'{type(error).__name__}: {error}'})
+                print(f'FAILED {futures[future]}: {type(error).__name__}: {error}', file=sys.stderr)
+            else:
+                results.append(result)
+                print(f"{result['design']} -> {result['output']} ({result['conditions']} conditions, {result['seconds']:.2f} s)")
+
+    total_seconds = time.perf_counter() - start
+    print(f'{len(results)} converted, {len(failures)} failed in {total_seconds:.2f} s')
+    if args.summary:
+        with open(args.summary, 'w') as summary_file:
+            json.dump({'total_seconds': round(total_seconds, 4), 'converted': sorted(results, key=lambda result: result['design']), 'failed': failures}, summary_file, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
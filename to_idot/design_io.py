@@ -0,0 +1,66 @@
+"""
+Reading DoE designs, whatever format they come in
+
+The format is sniffed once from the first bytes of the file (the magic numbers of Parquet, Feather/Arrow and excel
+files), so a design is only ever parsed once. csv files are read with pyarrow's multithreaded parser when pyarrow is
+installed, and with pandas' own parser otherwise.
+"""
+from pathlib import Path
+import io
+
+import pandas as pd
+
+DESIGN_SUFFIXES = ('.csv', '.xlsx', '.parquet', '.feather', '.arrow')
+
+# first bytes of each binary format, anything else is taken to be csv
+MAGIC_NUMBERS = {
+    b'PAR1': 'parquet',
+    b'ARROW1': 'feather',
+    b'PK\x03\x04': 'excel',
+    b'\xd0\xcf\x11\xe0': 'excel',
+}
+
+
+def sniff_format(head):
+    """
+    Works out a design's format from the start of the file
+    :param head: the first bytes of the file (8 is enough)
+    :return: 'parquet', 'feather', 'excel' or 'csv'
+    """
+    for magic, file_format in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return file_format
+    return 'csv'
+
+
+def _read_csv(source):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return pd.read_csv(source)
+    df = pd.read_csv(source, engine='pyarrow')
+    # pyarrow leaves blank headers empty, pandas' parser names them 'Unnamed: <position>' and the pipeline relies on that
+    return df.rename(columns={name: f'Unnamed: {i}' for i, name in enumerate(df.columns) if name == ''})
+
+
+def read_design(source):
+    """
+    Reads a DoE design from a csv, excel, Parquet or Feather file
+    :param source: path, bytes or a binary file object (e.g. a Streamlit upload)
+    :return: dataframe of the design
+    """
+    if isinstance(source, (str, Path)):
+        with open(source, 'rb') as design_file:
+            return read_design(design_file)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    start = source.tell()
+    file_format = sniff_format(source.read(8))
+    source.seek(start)
+    if file_format == 'parquet':
+        return pd.read_parquet(source)
+    if file_format == 'feather':
+        return pd.read_feather(source)
+    if file_format == 'excel':
+        return pd.read_excel(source)
+    return _read_csv(source)
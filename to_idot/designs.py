@@ -0,0 +1,213 @@
+"""
+Generated DoE designs
+
+Full factorial, fractional factorial, central composite and Latin hypercube designs, made inside the app instead of
+being uploaded. A design never holds its condition matrix: any run of conditions is worked out from the row numbers
+when it is asked for, so designs far bigger than memory can still be streamed into doe_to_idot_main a plate at a
+time, and iterated over as many times as needed.
+"""
+from dataclasses import dataclass
+from functools import cached_property
+import abc
+import math
+
+import numpy as np
+import pandas as pd
+
+
+class Design(abc.ABC):
+    """
+    Base of the generated designs, one column per factor (reagent) holding its target concentration
+    Subclasses hold the factors dictionary and give __len__ and rows.
+    """
+    @property
+    def columns(self):
+        return tuple(self.factors)
+
+    @abc.abstractmethod
+    def rows(self, start, stop):
+        """
+        :param start: first condition
+        :param stop: one past the last condition
+        :return: 2D float array of the target concentrations, one row per condition and one column per factor
+        """
+
+    @abc.abstractmethod
+    def __len__(self):
+        """
+        :return: number of conditions in the design
+        """
+
+    def batches(self, batch_size=96):
+        """
+        The design a batch of conditions at a time
+        :param batch_size: conditions per batch, e.g. the wells of one target plate
+        :return: generator of dataframes, one column per factor, indexed by condition number
+        """
+        for start in range(0, len(self), batch_size):
+            stop = min(start + batch_size, len(self))
+            yield pd.DataFrame(self.rows(start, stop), columns=list(self.columns), index=pd.RangeIndex(start, stop))
+
+    def __iter__(self):
+        # one condition (row of concentrations) at a time
+        for batch in self.batches():
+            yield from batch.to_numpy()
+
+    def to_frame(self):
+        """
+        :return: the whole design as a dataframe, only sensible for designs that fit in memory
+        """
+        return pd.DataFrame(self.rows(0, len(self)), columns=list(self.columns))
+
+
+def _two_level(factors):
+    """
+    Low and high concentration of every factor, checking each has exactly two
+    """
+    levels = np.asarray([factors[name] for name in factors], dtype=float)
+    if levels.ndim != 2 or levels.shape[1] != 2 or not len(levels):
+        raise ValueError('a design needs factors, each with a (low, high) pair of concentrations')
+    return levels[:, 0], levels[:, 1]
+
+
+def _corners(index, n_factors):
+    """
+    Coded (-1/+1) corners of a two-level factorial in standard order (the first factor changes fastest)
+    """
+    return ((np.asarray(index, dtype=np.int64)[:, None] >> np.arange(n_factors)) & 1) * 2 - 1
+
+
+@dataclass(frozen=True)
+class FullFactorial(Design):
+    """
+    Every combination of the levels of every factor, in standard order (the first factor changes fastest)
+    :param factors: dictionary of factor (reagent) name to the list of its levels (target concentrations)
+    """
+    factors: dict
+
+    def __post_init__(self):
+        if not self.factors or any(len(levels) == 0 for levels in self.factors.values()):
+            raise ValueError('a design needs factors, each with at least one level')
+
+    def __len__(self):
+        return math.prod(len(levels) for levels in self.factors.values())
+
+    def rows(self, start, stop):
+        shape = [len(levels) for levels in self.factors.values()]
+        codes = np.unravel_index(np.arange(start, stop), shape, order='F')
+        return np.column_stack([np.asarray(levels, dtype=float)[code] for levels, code in zip(self.factors.values(), codes)])
+
+
+@dataclass(frozen=True)
+class FractionalFactorial(Design):
+    """
+    A two-level fractional factorial: a full factorial of the base factors, every generated factor set by the product
+    of its generator's base factors (e.g. {'E': ('A', 'B', 'C')} for E = ABC)
+    :param factors: dictionary of factor name to its (low, high) concentrations, in column order
+    :param generators: dictionary of generated factor name to the base factors it is aliased with
+    """
+    factors: dict
+    generators: dict
+
+    def __post_init__(self):
+        _two_level(self.factors)
+        base = self.base_factors
+        for name, word in self.generators.items():
+            if name not in self.factors:
+                raise ValueError(f'generated factor {name} is not one of the factors')
+            if not word or any(factor not in base for factor in word):
+                raise ValueError(f'the generator of {name} must be made of base factors {base}')
+
+    @property
+    def base_factors(self):
+        return [name for name in self.factors if name not in self.generators]
+
+    def __len__(self):
+        return 2 ** len(self.base_factors)
+
+    def rows(self, start, stop):
+        low, high = _two_level(self.factors)
+        base = self.base_factors
+        base_coded = _corners(np.arange(start, stop), len(base))
+        coded = np.empty((stop - start, len(self.factors)), dtype=np.int64)
+        for column, name in enumerate(self.factors):
+            if name in self.generators:
+                coded[:, column] = np.prod([base_coded[:, base.index(factor)] for factor in self.generators[name]], axis=0)
+            else:
+                coded[:, column] = base_coded[:, base.index(name)]
+        return np.where(coded > 0, high, low)
+
+
+@dataclass(frozen=True)
+class CentralComposite(Design):
+    """
+    A central composite design: the two-level factorial corners, a pair of axial points per factor, then the centre points
+    :param factors: dictionary of factor name to its (low, high) concentrations
+    :param alpha: distance of the axial points from the centre, in units of half the range. 1 (default) is face
+    centred and stays within (low, high), (2 ** n_factors) ** 0.25 is rotatable
+    :param centre_points: number of repeats of the centre point
+    """
+    factors: dict
+    alpha: float = 1.0
+    centre_points: int = 1
+
+    def __post_init__(self):
+        low, high = _two_level(self.factors)
+        if np.any((low + high) / 2 - self.alpha * (high - low) / 2 < 0):
+            raise ValueError(f'alpha {self.alpha} puts axial points below zero concentration')
+
+    def __len__(self):
+        n_factors = len(self.factors)
+        return 2 ** n_factors + 2 * n_factors + self.centre_points
+
+    def rows(self, start, stop):
+        low, high = _two_level(self.factors)
+        n_factors = len(self.factors)
+        index = np.arange(start, stop)
+        coded = np.zeros((len(index), n_factors))
+        corners = index < 2 ** n_factors
+        coded[corners] = _corners(index[corners], n_factors)
+        #axial points, low then high along each factor in turn
+        axial = index - 2 ** n_factors
+        on_axis = (axial >= 0) & (axial < 2 * n_factors)
+        coded[np.flatnonzero(on_axis), axial[on_axis] // 2] = np.where(axial[on_axis] % 2, self.alpha, -self.alpha)
+        return (low + high) / 2 + coded * (high - low) / 2
+
+
+@dataclass(frozen=True)
+class LatinHypercube(Design):
+    """
+    A Latin hypercube sample: each factor's range is cut into n_samples strata and every stratum is used once
+    :param factors: dictionary of factor name to its (low, high) concentrations
+    :param n_samples: number of conditions
+    :param seed: random seed, the same seed always gives the same design
+    """
+    factors: dict
+    n_samples: int
+    seed: int = 0
+
+    def __post_init__(self):
+        _two_level(self.factors)
+
+    def __len__(self):
+        return self.n_samples
+
+    @cached_property
+    def _strata(self):
+        # the stratum of every condition, one shuffle per factor (n_samples ints each, the only part held in memory)
+        rng = np.random.default_rng(self.seed)
+        return np.stack([rng.permutation(self.n_samples) for _ in self.factors], axis=1)
+
+    def _jitter(self, start, stop):
+        # position within each stratum from a counter based generator, skipped straight to the first condition so
+        # any run of conditions comes out the same however the design is batched
+        n_factors = len(self.factors)
+        bit_generator = np.random.Philox(key=self.seed)
+        bit_generator.advance(start * n_factors // 4)
+        rng = np.random.Generator(bit_generator)
+        rng.random(start * n_factors % 4)
+        return rng.random((stop - start) * n_factors).reshape(stop - start, n_factors)
+
+    def rows(self, start, stop):
+        low, high = _two_level(self.factors)
+        return low + (self._strata[start:stop] + self._jitter(start, stop)) / self.n_samples * (high - low)
@@ -0,0 +1,143 @@
+"""
+Run-time estimates for iDOT worklists and reordering of the dispenses to shorten them
+
+The model splits a plate's worklist into blocks of consecutive dispenses from the same source well. Every block costs
+a source well switch plus the time of its dispenses, and the blocks are shared out between the parallel channels in
+the order they come in the worklist. A plate takes as long as its busiest channel.
+"""
+from dataclasses import dataclass
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from .units import to_microlitres
+
+
+@dataclass(frozen=True)
+class InstrumentModel:
+    """
+    Timings used to estimate how long the iDOT takes to dispense a worklist.
+    The defaults are rough figures, calibrate them against the run logs of your own instrument.
+    :param source_switch_s: time to move to (and start dispensing from) a new source well
+    :param per_dispense_s: fixed overhead of every dispense
+    :param seconds_per_ul: extra time for every ul dispensed
+    :param channels: number of source wells that can be dispensed from at the same time
+    :param plate_change_s: time to swap to the next target plate
+    :param source_plate_change_s: time to swap source plates, when a target plate draws from more than one
+    """
+    source_switch_s: float = 1.5
+    per_dispense_s: float = 0.05
+    seconds_per_ul: float = 0.02
+    channels: int = 8
+    plate_change_s: float = 30.0
+    source_plate_change_s: float = 30.0
+
+
+def _source_codes(worklist):
+    """
+    :return: integer code of every row's source well, different for the same well name on different source plates
+    """
+    # integer codes, so comparing neighbours doesn't compare strings
+    source_wells, names = pd.factorize(worklist['Source Well'])
+    if 'Source Plate' in worklist.columns:
+        source_wells = worklist['Source Plate'].to_numpy(dtype=np.int64) * max(len(names), 1) + source_wells
+    return source_wells
+
+
+def _source_plates(worklist):
+    """
+    :return: source plate of every row (all 0 for worklists without the column)
+    """
+    if 'Source Plate' in worklist.columns:
+        return worklist['Source Plate'].to_numpy(dtype=np.int64)
+    return np.zeros(len(worklist), dtype=np.int64)
+
+
+def _source_blocks(worklist, model):
+    """
+    Splits a worklist into blocks of consecutive dispenses from the same source well
+    :return:
+    block_ids: block number of every row
+    block_times: time each block takes on one channel
+    """
+    source_wells = _source_codes(worklist)
+    row_times = model.per_dispense_s + to_microlitres(worklist['Volume [pl]'].to_numpy()) * model.seconds_per_ul
+    new_block = np.ones(len(source_wells), dtype=bool)
+    new_block[1:] = source_wells[1:] != source_wells[:-1]
+    block_ids = np.cumsum(new_block) - 1
+    block_times = np.bincount(block_ids, weights=row_times) + model.source_switch_s if len(block_ids) else np.array([])
+    return block_ids, block_times
+
+
+def _makespan(block_times, channels):
+    """
+    Hands each block, in order, to whichever channel is free first
+    :return: time until the last channel finishes
+    """
+    channel_free_at = [0.0] * max(1, channels)
+    for block_time in block_times:
+        heapq.heapreplace(channel_free_at, channel_free_at[0] + block_time)
+    return max(channel_free_at)
+
+
+def estimate_plate_time(worklist, model=None):
+    """
+    Estimates how long one target plate's worklist takes to dispense
+    :param worklist: dataframe from get_source_wells (needs 'Source Well' and 'Volume [pl]')
+    :param model: InstrumentModel, the defaults are used if not given
+    :return: estimated time in seconds
+    """
+    model = model or InstrumentModel()
+    _, block_times = _source_blocks(worklist, model)
+    #each extra source plate is a swap
+    source_plate_swaps = max(len(np.unique(_source_plates(worklist))) - 1, 0)
+    return _makespan(block_times, model.channels) + source_plate_swaps * model.source_plate_change_s
+
+
+def estimate_run_time(worklists, model=None):
+    """
+    Estimates how long a whole iDOT run takes
+    :param worklists: list of worklist dataframes, one per target plate
+    :param model: InstrumentModel, the defaults are used if not given
+    :return: estimated time in seconds
+    """
+    model = model or InstrumentModel()
+    return sum(estimate_plate_time(worklist, model) + model.plate_change_s for worklist in worklists)
+
+
+def optimize_dispense_order(worklist, model=None):
+    """
+    Reorders one plate's worklist to shorten its estimated dispense time.
+    Every source well is visited once (all of its dispenses together, in their original order), then the source wells
+    are tried longest first so the channels finish as close together as possible. The dispenses from each source plate
+    are kept together, in source plate order, as they are written to the .csv. Whichever order has the shorter
+    estimate is kept, so the result is never slower than the worklist it was given.
+    :param worklist: dataframe from get_source_wells
+    :param model: InstrumentModel, the defaults are used if not given
+    :return: reordered copy of the worklist
+    """
+    model = model or InstrumentModel()
+    if len(worklist) == 0:
+        return worklist
+    # group all the dispenses from each source well, keeping their order within the well
+    source_codes = _source_codes(worklist)
+    grouped = worklist.iloc[np.lexsort((source_codes, _source_plates(worklist)))].reset_index(drop=True)
+    block_ids, block_times = _source_blocks(grouped, model)
+    # longest blocks first within each source plate, ties keep their current order
+    block_rank = np.empty(len(block_times), dtype=np.int64)
+    block_rank[np.argsort(-block_times, kind='stable')] = np.arange(len(block_times))
+    longest_first = grouped.iloc[np.lexsort((block_rank[block_ids], _source_plates(grouped)))].reset_index(drop=True)
+    candidates = [worklist.reset_index(drop=True), grouped, longest_first]
+    return min(candidates, key=lambda candidate: estimate_plate_time(candidate, model))
+
+
+def optimize_worklists(worklists, model=None):
+    """
+    Reorders every plate's worklist, see optimize_dispense_order
+    :param worklists: list of worklist dataframes, one per target plate
+    :param model: InstrumentModel, the defaults are used if not given
+    :return: list of reordered worklists
+    """
+    model = model or InstrumentModel()
+    return [optimize_dispense_order(worklist, model) for worklist in worklists]
@@ -1,421 +1,402 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
 from pathlib import Path
 
 import csv
 import io
+import os
 import datetime
-import math
+import logging
 import numpy as np
 import pandas as pd
-import platemapping.plate_map as pm
 
+from .designs import Design
+from .dispense_plan import InstrumentModel, estimate_plate_time, estimate_run_time, optimize_dispense_order, optimize_worklists
+from .instrumentation import logger, stage
+from .plate_layout import empty_map, well_names, well_order
+from .plates import PlateView, plate_volumes, plate_wells
+from .source_plan import SourcePlateType, continue_source_wells, place_reagents, plan_source_wells, plate_slice
+from .units import to_picolitres
+from .worklist import is_worklist, make_worklist, to_idot_layout
 
-def generate_target_vols(in_df, final_volume, starting_conc_dict, replicates=1, orientation='by_columns'):
+
+def calculate_volume_matrix(concentrations, final_volume, starting_concs):
     """
-    creates a target plate dataframe, containing the volumes to be added to each well (row). 
-    :param csv: doe template file (see SOP for more info)
+    Calculates the volume of each reagent to add to each well from the target concentrations.
+    Works on the whole design at once: every column is divided by the matching stock concentration.
+    :param concentrations: 2D array of target concentrations, one row per condition and one column per reagent
     :param final_volume: volume of each well
+    :param starting_concs: sequence of starting (stock) concentrations, in the same order as the columns
+    :return: 2D int64 array of volumes in pl, 0 wherever the concentration is 0
+    """
+    concentrations = np.asarray(concentrations, dtype=float)
+    starting_concs = np.asarray(starting_concs, dtype=float)
+    nonzero = concentrations != 0
+    # dilution factor for every cell, left as inf where nothing is added so the volume comes out as 0
+    dilution_factors = np.divide(starting_concs, concentrations, out=np.full(concentrations.shape, np.inf), where=nonzero)
+    #converted to picolitres here, everything after this is exact integer arithmetic
+    return to_picolitres(final_volume / dilution_factors)
+
+def unique_conditions(concentrations):
+    """
+    Finds the distinct conditions of a design, repeated rows (centre points, controls...) only need their volumes worked out once.
+    Rows are matched on a hash of their values rather than sorted, so this costs about as much as working the volumes
+    out once: only worth it when the volumes are worked out again and again (see pipeline.py)
+    :param concentrations: 2D array of target concentrations, one row per condition and one column per reagent
+    :return:
+    unique: 2D array of the distinct rows, in the order they first appear
+    condition_rows: for every condition, the position of its row in unique
+    """
+    concentrations = np.asarray(concentrations, dtype=float)
+    if len(concentrations) < 2 or not concentrations.shape[1]:
+        return concentrations, np.arange(len(concentrations))
+    row_hashes = pd.util.hash_pandas_object(pd.DataFrame(concentrations, copy=False), index=False).to_numpy()
+    condition_rows, distinct = pd.factorize(row_hashes)
+    #first condition of each distinct row, written backwards so the first occurrence is the one kept
+    first_rows = np.empty(len(distinct), dtype=np.int64)
+    first_rows[condition_rows[::-1]] = np.arange(len(concentrations) - 1, -1, -1)
+    return concentrations[first_rows], condition_rows.astype(np.int64)
+
+def generate_target_vols(in_df, final_volume, starting_conc_dict, replicates=1, orientation='by_columns', plate_size=96):
+    """
+    creates a target plate dataframe, containing the volumes (in pl) to be added to each well (row).
+    :param csv: doe template file (see SOP for more info)
+    :param final_volume: volume of each well in ul
     :param starting_conc_dict: dictionary detailing every reagents starting (stock) dilution
     :param replicates: Number of replicates per well/condition
     :param orientation: how the plate is dispensed, by columns is default, anything else will be taken as by rows
+    :param plate_size: number of wells on each target plate, 96, 384 or 1536
     :return:
+    list_df: list of PlateView (see plates.py), one per target plate, all sharing one volume matrix
+    map: the source plate map
     """
-    # read the .csv doe file
-    doe = in_df
-    # creating lists/dicts for data storage
-    col_list = []
+    # drop unneeded column if there (without touching the caller's dataframe)
+    doe = in_df.drop(columns='Unnamed: 0', errors='ignore')
     # makes a list of column names from the doe dataframe
-    for col in doe.columns:
-        col_list.append(col)
-    # drop unneeded column if there
-    if 'Unnamed: 0' in col_list:
-        doe.drop('Unnamed: 0', axis=1, inplace=True)
-    # iterates through the list of coolumn headers
-    for col in col_list:
-        #print(col)
-        temp_list = []
-        # iterates through every element in a column
-        for element in doe[col]:
-            # if the concentration is 0 then add is 0
-            if element == 0:
-                add = 0
-            # if concentration in column is not 0 then divide the starting concentration by the target concentration to get the dilution factor
-            else:
-                dilution_factor = starting_conc_dict[col] / element
-                #calculate how much to add
-                add = final_volume / dilution_factor
-                #have put a round in here, if this isn't hear then there are times where the volume doesn't quite reach the target by some ridiculously small amount, 
-                #leading to problems
-                add = round(add, 4)
-            # append the calculated volume to the list
-            temp_list.append(add)
-           # print(add)
-        # replace the column in doe with the list of amounts to add
-        doe[col] = temp_list
-        # print(f'column_sum_dict:{column_sum_dict}')
-    # replicates the values a number of times as defined in the replicates argument
-    if replicates != 1:
-        doe = pd.DataFrame(np.repeat(doe.values, replicates, axis=0))
-        #print(doe)
-    doe.columns = col_list
+    col_list = tuple(doe.columns)
+    # works out the volume of every reagent in one go, once per condition whatever the replicates
+    with stage('condition_volumes', conditions=len(doe)) as record:
+        concentrations = doe.to_numpy(dtype=float)
+        volumes = calculate_volume_matrix(concentrations, final_volume, [starting_conc_dict[col] for col in col_list])
+        if logger.isEnabledFor(logging.INFO) and len(doe):
+            #counting the distinct conditions costs as much as the volumes, so only when the stage is reported
+            record['unique_conditions'] = len(unique_conditions(concentrations)[0])
+            record['unique_ratio'] = round(record['unique_conditions'] / len(doe), 4)
     
-    # generating an empty plate map
-    map = pm.empty_map()
-    # getting the wells from the map
-    wells = map.index
-    # gets the length of the plate in rows
-    len_doe_plate = len(doe)
-    
-    # if the orientation is not by columns (default) then some code to do by rows
-    if orientation != 'by_columns':
-        wells = pd.Series(wells)
-        #making loads of replicates of the well names to accommodate any number of plates 
-        wells_repeated = pd.concat([wells]*100, ignore_index=True)
-        #truncates the number of wells by the length of the plate
-        correct_length_wells = wells_repeated[0:len_doe_plate]
-        #print(f'correct wells list: {correct_length_wells}')
-        doe['Well'] = correct_length_wells
-        
-    else:
-        by_columns_list = []
-        for i in range(12):
-            temp_list = list(wells[i::12])
-            by_columns_list = by_columns_list + temp_list
-        wells = pd.Series(by_columns_list)
-        #making loads of replicates of the well names to accommodate any number of plates (removes chance of index error) 
-        wells_repeated = pd.concat([wells]*100, ignore_index=True)
-        #truncates the number of wells by the length of the plate
-        correct_length_wells = wells_repeated[0:len_doe_plate]
-        #creating a well column with the correct length of wells
-        doe['Well'] = correct_length_wells
-    #converting series into a list of groups of 96 (i.e. by plate-sized chunks)
-    list_df = [doe[i:i+96] for i in range(0,doe.shape[0],96)]
-    for df in list_df:
-        #resetting the indices of each df
-        df.reset_index(drop=True, inplace=True)
+    # generating an empty plate map (used for the source plate wells)
+    map = empty_map()
+    #every plate fills its wells in the same (cached) order, so a plate's wells are the start of that order
+    well_codes = well_order(plate_size, orientation, codes=True)
+    target_wells = pd.Index(well_names(plate_size))
+    #replicates sit next to each other, row i of the replicated design is condition i // replicates
+    n_rows = len(volumes) * replicates
+    #splitting into plate-sized views, no volumes are copied here
+    list_df = [PlateView(volumes, col_list, i, min(i + plate_size, n_rows), replicates, well_codes[:min(plate_size, n_rows - i)], target_wells) for i in range(0, n_rows, plate_size)]
     return list_df, map
 
-def calculate_target_well_info_per_df(df_list, replicates):
+def calculate_target_well_info_per_df(df_list, replicates, source_plate=None):
     """
     Calculates the total reagent volumes and the number of source wells required to cover the reagent volumes
-    :param df_list: the list of dataframes corresponding to plates
-    :param replicates: the number of replicates per sample/condition
+    :param df_list: the list of plates (PlateView or dataframes with one column per reagent, then the 'Well' column)
+    :param replicates: the number of replicates per sample/condition (already part of each plate, kept so existing callers work)
+    :param source_plate: SourcePlateType of the source plates (its usable well volume), the default S.100 plate if not given
     :return:
-    sum_dictionary_list: the volume of reagent
+    sum_dictionary_list: the volume of reagent (in pl)
     starting_wells_dictionary_list: the number of source wells required per reagent
     """
+    usable_volume = (source_plate or SourcePlateType()).usable_volume_pl
     sum_dictionary_list = []
     starting_wells_dictionary_list = []
     for df in df_list:
-        #print(f'df: {df}')
-        col_list = []
-        temp_list = []
-        column_sum_dict = {}
-        starting_wells_count_dict = {}
-        starting_wells_volume_dict = {}
-        for col in df.columns:
-            col_list.append(col)
-        #iterates through the column list, except for the wells
-        for col in col_list[:-1]:
-            temp_list = df[col]
-            #get the sum total of a reagent in the list
-            col_sum = round(float(np.sum(temp_list)), 5) 
-            #define the sum volume as an element in the dictionary
-            column_sum_dict[col] = col_sum
-        for i in column_sum_dict:
-            #print(i, type(i))
-            #calculate the number of source wells required per reagent
-            if column_sum_dict[i] <=80:
-                starting_wells_count_dict[i] = 1
-            elif column_sum_dict[i] >80:
-                starting_wells_count_dict[i] = math.ceil(column_sum_dict[i]/80)
-                starting_wells_volume_dict[i] = round(float(column_sum_dict[i]/starting_wells_count_dict[i]),5)
-        #calculates the total number of starting wells required
-        total_starting_wells = np.sum(starting_wells_count_dict.values())
-        #print(f'ts: {total_starting_wells}')
-        sum_dictionary_list.append(column_sum_dict)
-        starting_wells_dictionary_list.append(starting_wells_count_dict)
+        #the volumes of every reagent, except for the wells
+        reagents, volumes = plate_volumes(df)
+        #get the sum total of every reagent on the plate
+        column_sums = volumes.sum(axis=0)
+        #calculate the number of source wells required per reagent (none if it isn't used on the plate)
+        wells_needed = -(-column_sums // usable_volume)
+        sum_dictionary_list.append(dict(zip(reagents, column_sums.tolist())))
+        starting_wells_dictionary_list.append(dict(zip(reagents, wells_needed.tolist())))
     return sum_dictionary_list, starting_wells_dictionary_list
 
-def get_source_wells(list_df, sum_wells_list, num_wells_list, map):
+def run_volumes(list_df, column):
+    """
+    One reagent's volumes over the whole run, all the plates one after another in dispense order
+    :param list_df: list of plates (PlateView or dataframes), one per target plate
+    :param column: position of the reagent in the plates' columns
+    :return: 1D int64 array of volumes (pl), one per target well of the run
+    """
+    if list_df and all(isinstance(df, PlateView) and df.conditions is list_df[0].conditions for df in list_df):
+        #plates cut from one design, read the reagent's column straight from it
+        first = list_df[0]
+        volumes = first.conditions[:, column]
+        if first.replicates != 1:
+            volumes = np.repeat(volumes, first.replicates)
+        return volumes[first.start:list_df[-1].stop]
+    if not list_df:
+        return np.array([], dtype=np.int64)
+    return np.concatenate([plate_volumes(df)[1][:, column] for df in list_df])
+
+def assemble_plate_worklist(allocations, target_wells, reagents, source_wells_list):
     """
-    Generates a dataframe containing the source well information as well as the target well information for each reagent added to the plates
-    :param list_df: list of dataframes corresponding to each plate
-    :param sum_wells_list: total volume per reagent
-    :param num_wells_list: total source wells per reagent
-    :param map: the map generated in a previous function (containing the wells)
+    Puts one plate's reagent allocations together into its worklist
+    :param allocations: for every reagent, in order, None or (rows on the plate, volumes, run-wide source well index), see source_plan.plate_slice
+    :param target_wells: categorical of the plate's target wells
+    :param reagents: reagent names, in the same order as allocations
+    :param source_wells_list: well names of one source plate, as a CategoricalDtype
+    :return: compact worklist (see worklist.py) detailing the volumes of each reagent to be dispensed on this plate
+    """
+    n_source_wells = len(source_wells_list.categories)
+    source_indices = []
+    target_codes = []
+    volume_list = []
+    liquid_codes = []
+    for reagent_index, allocation in enumerate(allocations):
+        if allocation is None:
+            continue
+        rows, volumes, source_wells = allocation
+        source_indices.append(source_wells)
+        target_codes.append(target_wells.codes[rows])
+        volume_list.append(volumes)
+        liquid_codes.append(np.full(len(volumes), reagent_index))
+    def joined(arrays):
+        return np.concatenate(arrays) if arrays else np.array([], dtype=np.int64)
+    #run-wide source well index to source plate and well on that plate
+    source_plates, source_codes = np.divmod(joined(source_indices), n_source_wells)
+    target_codes, volumes, liquid_codes = joined(target_codes), joined(volume_list), joined(liquid_codes)
+    if len(source_plates) and source_plates.max() > source_plates.min():
+        #the dispenses from each source plate together, in the order they are written to the .csv
+        order = np.argsort(source_plates, kind='stable')
+        source_plates, source_codes, target_codes, volumes, liquid_codes = source_plates[order], source_codes[order], target_codes[order], volumes[order], liquid_codes[order]
+    return make_worklist(source_codes, source_wells_list, target_codes, target_wells.dtype, volumes, liquid_codes, reagents, source_plates=source_plates)
+
+def _assemble_plate_worklist(job):
+    return assemble_plate_worklist(*job)
+
+def get_source_wells(list_df, sum_wells_list=None, num_wells_list=None, map=None, max_workers=1, progress=None, source_plate=None):
+    """
+    Generates a dataframe containing the source well information as well as the target well information for each reagent added to the plates.
+    The source wells are planned for the whole run (see source_plan.py): each reagent's dispenses on every plate share
+    source wells, and more source plates are used when one isn't enough.
+    :param list_df: list of plates (PlateView or dataframes), one per target plate
+    :param sum_wells_list: not used, the planner works from the volumes (kept so existing callers work)
+    :param num_wells_list: not used, the planner counts the source wells itself (kept so existing callers work)
+    :param map: source plate map, its index names the wells of one source plate (those of source_plate if not given)
+    :param max_workers: number of processes to put the plates' worklists together in, 1 (default) does them one after another in this process
+    :param progress: optional callback, called with (plates done, total plates) as each plate is finished
+    :param source_plate: SourcePlateType of the source plates, the default S.100 plate if not given
     :return:
     df_list: list of dataframes detailing the volumes of each reagent to be dispensed
     """
+    source_plate = source_plate or SourcePlateType()
+    #getting a list of plate wells for the source reagents, as one categorical dtype shared by every plate's worklist
+    source_wells_list = pd.CategoricalDtype(map.index if map is not None else source_plate.well_names())
+    if len(source_wells_list.categories) != source_plate.n_wells:
+        source_plate = replace(source_plate, n_wells=len(source_wells_list.categories))
+    if not list_df:
+        return []
+    reagents, _ = plate_volumes(list_df[0])
+    #the whole run is planned here first, it is quick next to putting the plates' worklists together
+    allocations = plan_source_wells([run_volumes(list_df, column) for column in range(len(reagents))], source_plate)
+
+    def plate_jobs():
+        #each plate's share of the plan, only the plate's own dispenses are sent to a worker process
+        start = 0
+        for df in list_df:
+            stop = start + len(df)
+            yield [plate_slice(allocation, start, stop) for allocation in allocations], plate_wells(df), reagents, source_wells_list
+            start = stop
+
     df_list = []
-    source_well_index = 0
-    for dict_index, df in enumerate(list_df):
-        #getting all of the number wells per substance dictionary keys and including in a list
-        dict_keys = list(num_wells_list[dict_index].keys())
-        #getting all of the number of wells per substance dictionary values and including in a list
-        dict_values = list(num_wells_list[dict_index].values())
-        df.reset_index(drop=True)
-        #count the number of loops, starting at 0, obviously
-        iter_count = 0
-        #full_plate_list = [96, 192, 288, 384, 480, 576, 672, 768, 864, 960, 1056, 1152, 1248, 1344, 1440, 1536, 1632, 1728, 1824, 1920, 2016, 2112, 2208, 2304, 2400, 2496, 2592, 2688, 2784, 2880, 2976, 3072, 3168, 3264, 3360, 3456, 3552, 3648, 3744, 3840, 3936, 4032, 4128, 4224, 4320, 4416, 4512, 4608, 4704, 4800, 4896, 4992, 5088, 5184, 5280, 5376, 5472, 5568, 5664, 5760, 5856, 5952, 6048, 6144]
-        #creating new df with correct titles 
-        new_df = pd.DataFrame(columns = ['Source Well', 'Target Well', 'Volume [ul]', 'Liquid Name','','','','',''])
-        # making a list of reagents, e.g. [Substance A, Substance A, Substance B, Substance C, Substance C]. This makes it easier to index the correct reagent
-        source_reagent_list = []
-        for i in range (len(dict_keys)):
-            well = [dict_keys[i]] * dict_values[i]
-            source_reagent_list = source_reagent_list + well 
-        #getting a list of plate wells for the source reagents
-        source_wells_list = map.index
-        #getting the length of the source reagents list
-        num_source_wells = len(source_reagent_list)
-        #truncating the source wells according to the length 
-        source_wells_list = source_wells_list[:num_source_wells*len(df.columns[:-1])*len(list_df)]
-        #iterate through each column from the target dataframe
-        for column in df.columns[:-1]: 
-            #source_wells = 0
-            one_column_iteration_count = 1
-            # counter for volume of all of the source wells of 1 reagent
-            total_reagent_counter = 0
-            # counter for the volume taken from 1 well
-            volume_counter = 0
-            #making a list from reagents
-            temp_list = df[column]
-            # making a list from the wells
-            well_list = df['Well']
-            #print(well_list)
-            for reagent_list_index, value in enumerate(temp_list):
-                value = round(float(value),5)
-                if value == 0:
-                    volume_counter = round(float(volume_counter + value),5)
-                    iter_count = iter_count + 1
-                # if there is something to add to a well, do something
-                elif value != 0.0:
-                    # keeping track of the volume from one well
-                    volume_counter = round(float(volume_counter + value),5)
-                    #keeping track of volume from all wells of 1 reagent
-                    total_reagent_counter = round(float(total_reagent_counter + value),5)
-                    #if the max volume from one well has been reached, change index of source well
-                    if volume_counter > 79.99:
-                        source_well_index=source_well_index+1
-                        #reset the volume added to reflect the amount from the new source reagent well
-                        volume_counter = value
-                    #if the total volume is equal to the total reagent volume then break the loop and start
-                    #generating one row, equating to addition to one well, blanks to get correct shape
-                    one_row =  [source_wells_list[source_well_index], well_list[reagent_list_index], value, column,'' ,'' ,'' ,'' ,'' ]
-                    #adding the row to the df
-                    new_df.loc[iter_count] = one_row
-                    iter_count = iter_count + 1
-                    #print(f'sum_wells_list[dict_index][column]: {sum_wells_list[dict_index][column]}')
-                    #print(f'total_reagent_counter:{total_reagent_counter}')
-                    #if the total reagent is equal to the total amount calculated, skip to the next source well and break 
-                    if total_reagent_counter >= sum_wells_list[dict_index][column]:
-                        source_well_index=source_well_index+1
-                        break
-                    #or if the number of source well iterations is equal to the total source wells, move on and break (this is a fail safe for the above)
-                    elif one_column_iteration_count == len(temp_list):
-                        source_well_index=source_well_index+1
-                        break
-                one_column_iteration_count += 1 
-                #print(one_column_iteration_count)
-        new_df = new_df.reset_index(drop=True)
-        df_list.append(new_df)
+    def collect(worklists):
+        for worklist in worklists:
+            df_list.append(worklist)
+            if progress is not None:
+                progress(len(df_list), len(list_df))
+
+    if max_workers > 1 and len(list_df) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            #map gives the worklists back in plate order
+            collect(pool.map(_assemble_plate_worklist, plate_jobs(), chunksize=max(1, len(list_df) // (4 * max_workers))))
+    else:
+        collect(_assemble_plate_worklist(job) for job in plate_jobs())
     return df_list
 
-def generate_csv_file(csv_buffer, list_df, idot_header=True, dispense_plate='MWP 96'):
+def iter_csv_chunks(list_df, idot_header=True, dispense_plate='MWP 96', source_plate=None):
     """
-    Creates a csv file from dataframe in a format suitable for the iDOT
-    :param csv_buffer: csv file buffer
-    :param list_df: list of dataframes to append into one file
+    Generates the .csv file for the iDOT one plate at a time, so the whole file never has to be held in memory.
+    A target plate that draws from more than one source plate gets a block (header and rows) per source plate.
+    :param list_df: list (or any iterable) of dataframes, one per plate
     :param idot_header: whether or not to include the header in the .csv
     :param dispense_plate: this will change whether it is for plating into the standard assay plates, or the qPCR plate
-    :return:
+    :param source_plate: SourcePlateType of the source plates (its name goes in the header), the default S.100 plate if not given
+    :return: generator of strings, the header block and worklist rows of each plate in turn
     """
-
     date = datetime.date.today()
-    
-    for plate_number, df in enumerate(list_df): 
+    source_plate = source_plate or SourcePlateType()
+    source_plate_name = source_plate.name
+    #the source wells' volume in litres, 8e-05 for the default 80 ul
+    well_volume_l = source_plate.well_volume_pl / 1e12
+
+    for plate_number, df in enumerate(list_df):
         plate_num = plate_number +1
-        #print(f'df: {df}')
-        if idot_header == True:
-            rows =[[date, '1.9.1.5', '<User Name>', date,'','',''],
-                ['S.100 Plate',f'Source Plate {1}','', 8.00E-05, dispense_plate, plate_num,'','Waste Tube'],
-                ['DispenseToWaste=True','DispenseToWasteCycles=3','DispenseToWasteVolume=1e-7','UseDeionisation=True','OptimizationLevel=ReorderAndParallel','WasteErrorHandlingLevel=Ask','SaveLiquids=Ask','']]
+        #row where each source plate's block starts (the rows are grouped by source plate)
+        block_starts = [0]
+        source_plate_numbers = [0]
+        if is_worklist(df):
+            if 'Source Plate' in df.columns and len(df):
+                source_plates = df['Source Plate'].to_numpy()
+                new_block = np.flatnonzero(source_plates[1:] != source_plates[:-1]) + 1
+                block_starts = [0] + new_block.tolist()
+                source_plate_numbers = source_plates[block_starts].tolist()
+            #worklists are kept compact in memory, the ul volumes and blank columns are only made here
+            df = to_idot_layout(df)
+        chunk = io.StringIO()
+        #the whole plate is converted to text at once, then split into the source plate blocks
+        df.to_csv(chunk, header=True, index=False)
+        lines = [line + os.linesep for line in chunk.getvalue().split(os.linesep)[:-1]]
+        column_header, rows = lines[0], lines[1:]
+        chunk = io.StringIO()
+        for block, source_plate_number in enumerate(source_plate_numbers):
+            if idot_header:
+                header_rows =[[date, '1.9.1.5', '<User Name>', date,'','',''],
+                    [source_plate_name,f'Source Plate {source_plate_number + 1}','', well_volume_l, dispense_plate, plate_num,'','Waste Tube'],
+                    ['DispenseToWaste=True','DispenseToWasteCycles=3','DispenseToWasteVolume=1e-7','UseDeionisation=True','OptimizationLevel=ReorderAndParallel','WasteErrorHandlingLevel=Ask','SaveLiquids=Ask','']]
+                writer = csv.writer(chunk)
+                writer.writerows(header_rows)
+            block_end = block_starts[block + 1] if block + 1 < len(block_starts) else len(rows)
+            chunk.write(column_header)
+            chunk.writelines(rows[block_starts[block]:block_end])
+        yield chunk.getvalue()
 
-            writer = csv.writer(csv_buffer)
-            writer.writerows(rows)
-        print(csv_buffer.readlines())
-        df.to_csv(csv_buffer, mode='a', header=True, index=False)
-        
- 
-def doe_to_idot_main(in_doe_df: pd.DataFrame, final_volume, starting_conc_dict, final_csv_buffer: io.TextIOWrapper, replicates=1, orientation='by_columns'):
+def generate_csv_file(csv_buffer, list_df, idot_header=True, dispense_plate='MWP 96', source_plate=None):
     """
-    Brings all the above functions together
-    :param in_doe_df pandas.DataFrame: source template dataframe (read from .csv)
-    :param final_volume: the final volume in each well
-    :param starting_conc_dict: dictionary of the starting concentrations for the reagents
-    :param final_csv_buffer: the output path for the iDOT .csv file
-    :param replicates: the number of replicates per well/condition
-    :param orientation: by columns or by rows. Default is by columns
+    Creates a csv file from dataframe in a format suitable for the iDOT
+    :param csv_buffer: csv file buffer, or a path to write the file to
+    :param list_df: list of dataframes to append into one file
+    :param idot_header: whether or not to include the header in the .csv
+    :param dispense_plate: this will change whether it is for plating into the standard assay plates, or the qPCR plate
+    :param source_plate: SourcePlateType of the source plates, the default S.100 plate if not given
     :return:
     """
-    df_list_first, plate_map = generate_target_vols(in_doe_df, final_volume, starting_conc_dict, replicates=replicates, orientation=orientation)
-    #print(df_list_first)
-    sum_wells_list, num_wells_list = calculate_target_well_info_per_df(df_list_first, replicates)
-    print(sum_wells_list, num_wells_list)
-    final_df_list = get_source_wells(df_list_first, sum_wells_list, num_wells_list, plate_map)
-    #print(final_df_list)
-    generate_csv_file(final_csv_buffer, final_df_list)
-    
+    if isinstance(csv_buffer, (str, Path)):
+        with open(csv_buffer, 'w', newline='') as csv_file:
+            generate_csv_file(csv_file, list_df, idot_header=idot_header, dispense_plate=dispense_plate, source_plate=source_plate)
+        return
+    #writing each plate as soon as it is generated
+    for chunk in iter_csv_chunks(list_df, idot_header=idot_header, dispense_plate=dispense_plate, source_plate=source_plate):
+        csv_buffer.write(chunk)
 
-
-def generate_df_from_template(path_to_template:str, volume_dna:float, primers_volume:float, final_volume_without_master_mix:float, primer_tubes_choice:int):
+def design_plates(design, final_volume, starting_conc_dict, replicates=1, orientation='by_columns', plate_size=96):
     """
-    This function takes excel template with well info and converts into a .csv file for the idot
-    :param path_to_template:
-    :param volume_dna:
-    :param primers_volume:
-    :param final_volume_without_master_mix:
-    :param primer_tubes_choice:
-    :return:
+    generate_target_vols for a generated design, working out one target plate at a time so the design is never held whole
+    :param design: Design (see designs.py)
+    :param final_volume: volume of each well in ul
+    :param starting_conc_dict: dictionary detailing every reagents starting (stock) dilution
+    :param replicates: Number of replicates per well/condition
+    :param orientation: how the plate is dispensed, by columns is default, anything else will be taken as by rows
+    :param plate_size: number of wells on each target plate, 96, 384 or 1536
+    :return: generator of PlateView, one per target plate, each holding only its own conditions
     """
-    #importing the excel template file as a dataframe
-    table = pd.read_excel(path_to_template, sheet_name='Sheet1')
-    print(table)
-    table.dropna(subset=['Group', 'Target'], inplace=True)
-    #making a list of unique groups (removing duplicates)
-    unique_groups = []
-    for value in table.Group:
-        if value not in unique_groups:
-            unique_groups.append(value)
-    #making a list of unique targets (removing duplicates)
-    unique_targets = []
-    #if there is only 1 tube of primers do the following
-    if primer_tubes_choice == 1:
-        for value in table.Target:
-            if value not in unique_targets:
-                unique_targets.append(value)
+    col_list = tuple(design.columns)
+    starting_concs = [starting_conc_dict[col] for col in col_list]
+    well_codes = well_order(plate_size, orientation, codes=True)
+    target_wells = pd.Index(well_names(plate_size))
+    n_rows = len(design) * replicates
+    for start in range(0, n_rows, plate_size):
+        stop = min(start + plate_size, n_rows)
+        #the conditions on this plate, replicated row i is condition i // replicates
+        first, last = start // replicates, (stop - 1) // replicates + 1
+        volumes = calculate_volume_matrix(design.rows(first, last), final_volume, starting_concs)
+        offset = first * replicates
+        yield PlateView(volumes, col_list, start - offset, stop - offset, replicates, well_codes[:stop - start], target_wells)
 
-    #if there are 2 primer tubes, suffix with _1 or _2 (forward and reverse primer tubes)
-    elif primer_tubes_choice == 2:
-        for value in table.Target:
-            if f'{value}_1' not in unique_targets:
-                value_1 = f'{value}_1'
-                unique_targets.append(value_1)
-            if f'{value}_2' not in unique_targets:
-                value_2 = f'{value}_2'
-                unique_targets.append(value_2)
-
-    print(f'unique_groups: {unique_groups}')
-    print(f'unique_targets: {unique_targets}')
-    #combining the lists of unique items generated above
-    collated_list = unique_groups + unique_targets
-    unique_targets_index = 0
-    #making dataframe with unique groups and targets generated above
-    df = pd.DataFrame(columns=collated_list)
-    #making a column for water, filling water wells with 0 by default
-    df['water'] = 0
-    #defining a column for wells based on the original imported table
-    df['Well'] = table['Wells']
-
-    #print(f'first_df: {df}')
-    # calculating how to populate the rest of the dataframe
-    if primer_tubes_choice == 1:
-        for i, row in enumerate(table['Group']):
-            #calculating how much DNA volume to add to each well (row)
-            df[row].iloc[i] = volume_dna/table['Dilution'].iloc[i]
-            #working out how much water to top up to final volume (excluding master mix)
-            df['water'].iloc[i] = final_volume_without_master_mix - ((volume_dna/table['Dilution'].iloc[i]) + primers_volume)
-        #filling the primer column
-        for i, row in enumerate(table['Target']):
-            #print(f'row: {row}')
-            df[row].iloc[i] = primers_volume
-    # slightly different maths for 2 primer tubes vs 1
-    elif primer_tubes_choice == 2:
-        for i, row in enumerate(table['Group']):
-            df[row].iloc[i] = volume_dna/table['Dilution'].iloc[i]
-            df['water'].iloc[i] = final_volume_without_master_mix - ((volume_dna/table['Dilution'].iloc[i]) + (primers_volume*2))
-        for i, row in enumerate(table['Target']):
-            #print(f'row: {row}')
-            df[f'{row}_1'].iloc[i] = primers_volume
-            df[f'{row}_2'].iloc[i] = primers_volume
-    #fill all other cells with 0
-    df = df.fillna(0)
-    print(df)
-
-    # generating an empty plate map
-    map = pm.empty_map()
-    #creating a list of cols
-    cols=[i for i in df.columns if i not in ["Well"]]
-    #print(f'cols:{cols}')
-    for col in cols:
-        df[col]=pd.to_numeric(df[col])
-    #needs to be in list for other code to work
-    df = [df]
-    return df, map
-
-
-def qPCR_to_idot_main(in_df, output_file_buffer, volume_dna, primers_volume, final_volume_without_master_mix, primer_tubes_choice:int):
+def stream_doe_to_idot(design, final_volume, starting_conc_dict, final_csv_buffer, replicates=1, orientation='by_columns', plate_size=96, optimize_order=False, instrument=None, progress=None, source_plate=None):
     """
-    Main file bringing together the functions from this file and the doe_to_idot file
-    :param in_df:
-    :param output_file_buffer:
-    :param volume_dna:
-    :param primers_volume:
-    :param final_volume_without_master_mix:
-    :param primer_tubes_choice:
-    :return:
+    doe_to_idot_main for a generated design, a target plate at a time.
+    The design is read twice: first to count the source wells every reagent needs over the whole run (so they can be
+    laid out over the source plates), then to build each plate's worklist and write it straight to the .csv. Only one
+    plate is ever in memory, the result is the same as converting the whole design in one go.
+    :param design: Design (see designs.py)
+    :return: estimated run time of the worklist in seconds
     """
+    source_plate = source_plate or SourcePlateType()
+    instrument = instrument or InstrumentModel()
+    reagents = list(design.columns)
+    n_plates = -(-len(design) * replicates // plate_size)
+    def plates():
+        return design_plates(design, final_volume, starting_conc_dict, replicates=replicates, orientation=orientation, plate_size=plate_size)
+
+    with stage('count_source_wells', conditions=len(design), plates=n_plates) as record:
+        states = [None] * len(reagents)
+        for plate in plates():
+            volumes = plate.volumes()
+            for column in range(len(reagents)):
+                reagent_volumes = volumes[:, column]
+                _, states[column] = continue_source_wells(reagent_volumes[reagent_volumes != 0], source_plate.usable_volume_pl, states[column])
+        first_wells, record['source_plates'] = place_reagents([0 if state is None else state[0] + 1 for state in states], source_plate.n_wells)
 
-    df, map = generate_df_from_template(in_df, volume_dna, primers_volume, final_volume_without_master_mix, primer_tubes_choice)
-    #print(df)
-    sum_dictionary_list, starting_wells_dictionary_list = calculate_target_well_info_per_df(df, 1)
-    #print(f'sum_dictionary_list: {sum_dictionary_list}, starting_wells_dictionary_list:{starting_wells_dictionary_list}')
-    df = get_source_wells(df, sum_dictionary_list, starting_wells_dictionary_list, map)
-    generate_csv_file(output_file_buffer, df, idot_header=True, dispense_plate='qpcr plate')
+    source_wells_list = pd.CategoricalDtype(source_plate.well_names())
+    run_time = 0.0
+    def worklists():
+        nonlocal run_time
+        states = [None] * len(reagents)
+        for plate_number, plate in enumerate(plates()):
+            volumes = plate.volumes()
+            allocations = []
+            for column in range(len(reagents)):
+                rows = np.flatnonzero(volumes[:, column])
+                well_offsets, states[column] = continue_source_wells(volumes[rows, column], source_plate.usable_volume_pl, states[column])
+                allocations.append((rows, volumes[rows, column], first_wells[column] + well_offsets) if len(rows) else None)
+            worklist = assemble_plate_worklist(allocations, plate.wells(), reagents, source_wells_list)
+            if optimize_order:
+                worklist = optimize_dispense_order(worklist, instrument)
+            run_time += estimate_plate_time(worklist, instrument) + instrument.plate_change_s
+            if progress is not None:
+                progress(plate_number + 1, n_plates)
+            yield worklist
 
-def plate_template_gen(path_to_template_file):
+    with stage('stream_worklists', plates=n_plates) as record:
+        generate_csv_file(final_csv_buffer, worklists(), dispense_plate=f'MWP {plate_size}', source_plate=source_plate)
+        record['estimated_seconds'] = run_time
+    return run_time
+
+def doe_to_idot_main(in_doe_df: pd.DataFrame, final_volume, starting_conc_dict, final_csv_buffer: io.TextIOWrapper, replicates=1, orientation='by_columns', plate_size=96, max_workers=1, optimize_order=False, instrument=None, progress=None, source_plate=None):
     """
-    Generates a .csv file which works with the CFX instrument and analysis software
-    :param path_to_template_file: str
-    :return: dataframe in list
+    Brings all the above functions together
+    :param in_doe_df pandas.DataFrame: source template dataframe (read from .csv), or a generated Design (see designs.py) which is streamed a plate at a time
+    :param final_volume: the final volume in each well
+    :param starting_conc_dict: dictionary of the starting concentrations for the reagents
+    :param final_csv_buffer: the output path for the iDOT .csv file
+    :param replicates: the number of replicates per well/condition
+    :param orientation: by columns or by rows. Default is by columns
+    :param plate_size: number of wells on each target plate, 96 (default), 384 or 1536
+    :param max_workers: number of processes to put the plate worklists together in (after the source wells of the whole run are planned), 1 (default) runs everything in this process
+    :param optimize_order: reorder each plate's dispenses to shorten the estimated run time
+    :param instrument: InstrumentModel used for the run time estimate (and the reordering), defaults are used if not given
+    :param progress: optional callback, called with (plates done, total plates) as each plate's worklist is built
+    :param source_plate: SourcePlateType of the source plates (well volume, dead volume, wells), the default S.100 plate if not given
+    :return: estimated run time of the worklist in seconds
     """
-    table = pd.read_excel(path_to_template_file, sheet_name='Sheet1')
-    #print(f'table: {table}')
-    table.dropna(subset=['Group', 'Target'], inplace=True)
-    #print(f'table2: {table}')
-    pt_df = pd.DataFrame(columns = ['Row','Column','*Target Name','*Sample Name','*Biological Group'])
-    pt_df['Wells'] = table['Wells']
-    for i, well in enumerate(table['Wells']):
-        well_row = well[0]
-        print(f'well_row:{well_row}')
-        well_column = well[1:]
-        pt_df['Row'].iloc[i] = well_row
-        pt_df['Column'].iloc[i] = well_column
-    for i, group in enumerate(table['Group']):
-        pt_df['*Sample Name'].iloc[i] = str(group)
-    for i, target in enumerate(table['Target']):
-        pt_df['*Target Name'].iloc[i] = str(target)
-    pt_df.drop(['Wells'], axis=1, inplace=True)
-    return [pt_df]
+    if isinstance(in_doe_df, Design):
+        return stream_doe_to_idot(in_doe_df, final_volume, starting_conc_dict, final_csv_buffer, replicates=replicates, orientation=orientation, plate_size=plate_size, optimize_order=optimize_order, instrument=instrument, progress=progress, source_plate=source_plate)
+    with stage('generate_target_vols', input_rows=len(in_doe_df), replicates=replicates) as record:
+        df_list_first, plate_map = generate_target_vols(in_doe_df, final_volume, starting_conc_dict, replicates=replicates, orientation=orientation, plate_size=plate_size)
+        record['plates'] = len(df_list_first)
+        record['output_rows'] = sum(len(df) for df in df_list_first)
+    with stage('get_source_wells', plates=len(df_list_first), max_workers=max_workers) as record:
+        final_df_list = get_source_wells(df_list_first, max_workers=max_workers, progress=progress, source_plate=source_plate)
+        record['output_rows'] = sum(len(df) for df in final_df_list)
+    if optimize_order:
+        with stage('optimize_worklists', plates=len(final_df_list)):
+            final_df_list = optimize_worklists(final_df_list, instrument)
+    with stage('generate_csv_file', plates=len(final_df_list)):
+        generate_csv_file(final_csv_buffer, final_df_list, dispense_plate=f'MWP {plate_size}', source_plate=source_plate)
+    with stage('estimate_run_time', plates=len(final_df_list)) as record:
+        record['estimated_seconds'] = estimate_run_time(final_df_list, instrument)
+    return record['estimated_seconds']
 
 
 if __name__ == '__main__':
-    # parser = argparse.ArgumentParser(
-    #                 prog='DOE to iDOT',
-    #                 description='translates simple DOE matrices in CSV or XLSX format into a CSV format that the iDOT by Dispendix can read',
-    #                 epilog='Authored by Mark Owen, modified and maintained by Alex')
-    # parser.add_argument("input",
-    #                     description="The input filename",
-    #                     action="store",
-    #                     help="Enter the name of the csv or xlsx file holding the DOE design",
-    #                     required=True,
-    #                     dest="in_file"
-    #                     )
-    # parser.add_argument("out"
-    #                     )
-    # Note: the units for the starting concentrations and the target concentrations (from the DoE) must be the same
-    starting_conc_dict = {'NaCl':100, 'FGF2':100, 'L-asc':100}
-    in_df = pd.read_csv('280cond-9-10-plates.csv')
-    out_file = open("280cond-9-10-plates-idot.csv", "w+", newline='')
-    doe_to_idot_main(in_df, 100, starting_conc_dict, out_file, replicates = 1, orientation ='by_rows')
-    out_file.close()
+    # batch conversion from the command line, see to_idot/cli.py (python -m to_idot --help)
+    from .cli import main
+    raise SystemExit(main())
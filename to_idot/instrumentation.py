@@ -0,0 +1,75 @@
+"""
+Timing and row counts for each stage of the pipelines, reported through logging
+
+Stage reports go to the 'to_idot' logger at INFO level, so they cost next to nothing unless logging is switched on.
+Setting the TO_IDOT_STAGE_LOG environment variable to a file path also writes every report to that file as json lines.
+"""
+from contextlib import contextmanager
+import datetime
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger('to_idot')
+
+
+@contextmanager
+def stage(name, **info):
+    """
+    Times one stage of a pipeline, anything added to the yielded dictionary (e.g. output rows) goes in the report
+    :param name: name of the stage
+    :param info: details known before the stage runs, e.g. input rows or plates
+    :return: context manager yielding the report dictionary
+    """
+    record = {'stage': name, **info}
+    if not logger.isEnabledFor(logging.INFO):
+        yield record
+        return
+    start = time.perf_counter()
+    yield record
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    details = ' '.join(f'{key}={value}' for key, value in record.items() if key not in ('stage', 'seconds'))
+    logger.info('%s took %.4f s %s', name, record['seconds'], details, extra={'stage_record': record})
+
+
+class JsonLinesHandler(logging.Handler):
+    """
+    Logging handler that writes each stage report as one line of json
+    """
+    def __init__(self, path):
+        super().__init__(level=logging.INFO)
+        self.path = path
+
+    def emit(self, record):
+        stage_record = getattr(record, 'stage_record', None)
+        if stage_record is None:
+            return
+        line = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(), **stage_record}
+        try:
+            with open(self.path, 'a') as jsonl_file:
+                jsonl_file.write(json.dumps(line, default=str) + '\n')
+        except Exception:
+            self.handleError(record)
+
+
+def add_jsonl_sink(path):
+    """
+    Sends the stage reports to a json lines file, switching on INFO logging for the pipelines if needed
+    :param path: file to append the reports to
+    :return: the handler, to remove it again with logger.removeHandler
+    """
+    handler = JsonLinesHandler(path)
+    logger.addHandler(handler)
+    if not logger.isEnabledFor(logging.INFO):
+        logger.setLevel(logging.INFO)
+    return handler
+
+
+def configure_from_env():
+    """
+    Adds a json lines sink if the TO_IDOT_STAGE_LOG environment variable is set
+    """
+    path = os.environ.get('TO_IDOT_STAGE_LOG')
+    if path and not any(isinstance(handler, JsonLinesHandler) and handler.path == path for handler in logger.handlers):
+        add_jsonl_sink(path)
@@ -0,0 +1,184 @@
+"""
+Background execution of conversions, so long runs don't block the Streamlit script thread
+
+Jobs run on a small, fixed pool of threads shared by every session. Each job reports how many plates are done and
+keeps its result (or error) once finished, for the page to pick up on a later rerun. A job nobody wants any more
+(e.g. its session changed the parameters) is cancelled, so it doesn't hold up the other sessions' jobs.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a conversion, from its progress callback, once its job has been cancelled
+    """
+
+
+class Job:
+    """
+    One submitted conversion
+    state is 'queued', 'running', 'done', 'failed' or 'cancelled', result or error are set when it finishes
+    """
+    def __init__(self, key=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.state = 'queued'
+        self.plates_done = 0
+        self.plates_total = None
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished_at = None
+        # submits of this job not yet let go (see JobExecutor.cancel)
+        self.holders = 1
+        self.cancelled = False
+        self._future = None
+
+    def progress(self, plates_done, plates_total):
+        """
+        Progress callback handed to the conversion
+        :param plates_done: plates finished so far
+        :param plates_total: plates in the whole run
+        :raises JobCancelled: if the job has been cancelled, stopping the conversion at its next plate
+        """
+        if self.cancelled:
+            raise JobCancelled(self.id)
+        self.plates_done = plates_done
+        self.plates_total = plates_total
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    @property
+    def fraction_done(self):
+        if self.state == 'done':
+            return 1.0
+        if not self.plates_total:
+            return 0.0
+        return min(self.plates_done / self.plates_total, 1.0)
+
+
+class JobExecutor:
+    """
+    Runs conversions on a bounded number of worker threads.
+    Submitting the same key again while a job with that key is queued, running or still remembered returns the existing job.
+    """
+    def __init__(self, max_workers=2, max_finished=32, discard=None):
+        """
+        :param max_workers: most conversions running at the same time
+        :param max_finished: finished jobs kept for later retrieval, the oldest are forgotten first
+        :param discard: optional callback, called with the result of every finished job that is forgotten (or
+        finishes after being cancelled), e.g. to delete the file it wrote
+        """
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='to_idot_job')
+        self._jobs = OrderedDict()
+        self._keys = {}
+        self._lock = threading.Lock()
+        self.max_finished = max_finished
+        self.discard = discard
+
+    def submit(self, func, *args, key=None, **kwargs):
+        """
+        Queues func(*args, progress=job.progress, **kwargs)
+        :param func: the conversion to run, must accept a progress keyword argument
+        :param key: optional hashable identifying the conversion, used to share identical jobs between sessions
+        :return: the job id
+        """
+        with self._lock:
+            if key is not None and key in self._keys:
+                job = self._jobs.get(self._keys[key])
+                if job is not None and job.state != 'failed':
+                    self._jobs.move_to_end(job.id)
+                    job.holders = job.holders + 1
+                    return job.id
+            job = Job(key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._keys[key] = job.id
+        job._future = self._pool.submit(self._run, job, func, args, kwargs)
+        return job.id
+
+    def get(self, job_id):
+        """
+        :param job_id: id returned by submit
+        :return: the Job, or None if it has been forgotten
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._jobs.move_to_end(job_id)
+            return job
+
+    def cancel(self, job_id):
+        """
+        Lets go of a job that is no longer wanted, once for every time it was submitted.
+        When every submit has let go of an unfinished job it is cancelled and forgotten: a queued job never starts, a
+        running one stops at its next progress report. Finished jobs are kept for anyone submitting them again.
+        :param job_id: id returned by submit
+        :return: True if the job was cancelled
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            job.holders = job.holders - 1
+            if job.holders > 0:
+                return False
+            job.cancelled = True
+            job.state = 'cancelled'
+            self._forget(job)
+        if job._future is not None:
+            job._future.cancel()
+        return True
+
+    def _run(self, job, func, args, kwargs):
+        if job.cancelled:
+            return
+        job.state = 'running'
+        try:
+            result = func(*args, progress=job.progress, **kwargs)
+        except JobCancelled:
+            return
+        except Exception as error:
+            job.error = error
+            job.state = 'failed'
+        else:
+            with self._lock:
+                wanted = not job.cancelled
+                if wanted:
+                    job.result = result
+                    job.state = 'done'
+            if not wanted:
+                # cancelled after its last progress report, nobody will pick the result up
+                self._discard(result)
+                return
+        job.finished_at = time.time()
+        self._forget_old_jobs()
+
+    def _forget(self, job):
+        # called with the lock held
+        self._jobs.pop(job.id, None)
+        if job.key is not None and self._keys.get(job.key) == job.id:
+            del self._keys[job.key]
+
+    def _forget_old_jobs(self):
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.finished]
+            forgotten = finished[:max(0, len(finished) - self.max_finished)]
+            for job in forgotten:
+                self._forget(job)
+        for job in forgotten:
+            if job.state == 'done':
+                self._discard(job.result)
+
+    def _discard(self, result):
+        if self.discard is not None:
+            self.discard(result)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,233 @@
+"""
+Incremental DoE to iDOT conversion, for trying out parameters on the same design over and over
+
+DoePipeline keeps the intermediate results of doe_to_idot_main between runs and only recomputes what a changed
+parameter affects:
+- a reagent's stock concentration: that reagent's column of the volume matrix, its plate sums and the packing of its
+  dispenses into source wells
+- the final volume: every column of the volume matrix (and so everything after it)
+- replicates, orientation, plate size or the source plate type: the plates and everything after them, the volume
+  matrix is kept
+Only the cheap steps are always redone: laying the reagents out over the source plates and joining the allocations
+into worklists, the optional reordering, writing the .csv and the run time estimate.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .dispense_plan import estimate_run_time, optimize_worklists
+from .doe_to_idot import assemble_plate_worklist, calculate_volume_matrix, generate_csv_file, unique_conditions
+from .instrumentation import stage
+from .plate_layout import well_names, well_order
+from .plates import PlateView
+from .source_plan import SourcePlateType, allocate_reagent, place_reagents, plate_slice
+
+
+class DoePipeline:
+    """
+    A DoE design plus the parameters of its conversion, remembering the intermediate results.
+    Set parameters with update (or pass them to run), the results are worked out when they are next needed.
+    Safe to share between threads, runs are one at a time.
+    """
+    def __init__(self, in_doe_df, final_volume=None, starting_conc_dict=None, replicates=1, orientation='by_columns', plate_size=96, source_plate=None):
+        """
+        :param in_doe_df: source template dataframe (read from .csv)
+        :param final_volume: the final volume in each well
+        :param starting_conc_dict: dictionary of the starting concentrations for the reagents
+        :param replicates: the number of replicates per well/condition
+        :param orientation: by columns or by rows. Default is by columns
+        :param plate_size: number of wells on each target plate, 96 (default), 384 or 1536
+        :param source_plate: SourcePlateType of the source plates, the default S.100 plate if not given
+        """
+        # drop unneeded column if there (without touching the caller's dataframe)
+        doe = in_doe_df.drop(columns='Unnamed: 0', errors='ignore')
+        self.reagents = tuple(doe.columns)
+        # the volumes are worked out again on every change, so only for the distinct conditions when enough of them
+        # repeat to pay for gathering them back out to every condition. condition_rows maps every condition to its row
+        concentrations = doe.to_numpy(dtype=float)
+        self._concentrations, self._condition_rows = unique_conditions(concentrations)
+        self.n_unique_conditions = len(self._concentrations)
+        if self.n_unique_conditions > len(doe) // 2:
+            self._concentrations, self._condition_rows = concentrations, None
+        self.n_conditions = len(doe)
+        self.final_volume = None
+        self.stocks = {}
+        self.replicates = 1
+        self.orientation = 'by_columns'
+        self.plate_size = 96
+        self.source_plate = SourcePlateType()
+        self._lock = threading.RLock()
+        # volume matrix (pl) of the design, one row per condition, and which of its columns need working out again
+        self._volumes = np.zeros((self.n_conditions, len(self.reagents)), dtype=np.int64)
+        self._stale_columns = set(range(len(self.reagents)))
+        self._plates = None
+        # per reagent (column index): its total on every plate and its dispenses over the whole run packed into source wells
+        self._plate_sums = {}
+        self._allocations = {}
+        # the joined worklists, kept until any allocation changes
+        self._worklists = None
+        self.update(final_volume=final_volume, starting_conc_dict=starting_conc_dict or {}, replicates=replicates, orientation=orientation, plate_size=plate_size, source_plate=source_plate)
+
+    def update(self, final_volume=None, starting_conc_dict=None, replicates=None, orientation=None, plate_size=None, source_plate=None):
+        """
+        Changes some of the parameters, anything left as None is kept as it is
+        :param starting_conc_dict: stock concentrations to change, reagents not in it keep their current stock
+        :return: set of the reagents whose volumes will be worked out again
+        :raises ValueError: if starting_conc_dict names a reagent that isn't a column of the design
+        """
+        with self._lock:
+            if final_volume is not None and final_volume != self.final_volume:
+                self.final_volume = final_volume
+                self._stale_columns.update(range(len(self.reagents)))
+            unknown = [reagent for reagent in (starting_conc_dict or {}) if reagent not in self.reagents]
+            if unknown:
+                raise ValueError(f'{unknown} are not reagents of the design')
+            for reagent, conc in (starting_conc_dict or {}).items():
+                if self.stocks.get(reagent) != conc:
+                    self.stocks[reagent] = conc
+                    self._stale_columns.add(self.reagents.index(reagent))
+            layout = {'replicates': replicates, 'orientation': orientation, 'plate_size': plate_size, 'source_plate': source_plate}
+            changed_layout = False
+            for name, value in layout.items():
+                if value is not None and value != getattr(self, name):
+                    setattr(self, name, value)
+                    changed_layout = True
+            if changed_layout:
+                # every plate (or the size of every source well) changes, nothing worked out per plate can be kept
+                self._plates = None
+                self._plate_sums.clear()
+                self._allocations.clear()
+                self._worklists = None
+            return {self.reagents[column] for column in self._stale_columns}
+
+    @property
+    def unique_ratio(self):
+        """
+        Distinct conditions over all conditions of the design, 1.0 when no condition is repeated
+        """
+        return self.n_unique_conditions / self.n_conditions if self.n_conditions else 1.0
+
+    def _refresh_volumes(self):
+        """
+        Works out the stale columns of the volume matrix again, dropping the per plate results of any column that changed
+        """
+        if not self._stale_columns:
+            return
+        if self.final_volume is None:
+            raise ValueError('no final volume has been set')
+        missing = [self.reagents[column] for column in sorted(self._stale_columns) if self.reagents[column] not in self.stocks]
+        if missing:
+            raise ValueError(f'no stock concentration for {missing}')
+        columns = sorted(self._stale_columns)
+        with stage('pipeline_volume_matrix', columns=len(columns), conditions=self.n_conditions, unique_conditions=self.n_unique_conditions) as record:
+            new_volumes = calculate_volume_matrix(self._concentrations[:, columns], self.final_volume, [self.stocks[self.reagents[column]] for column in columns])
+            if self._condition_rows is not None:
+                new_volumes = new_volumes[self._condition_rows]
+            changed = [column for i, column in enumerate(columns) if not np.array_equal(new_volumes[:, i], self._volumes[:, column])]
+            record['changed_columns'] = len(changed)
+            if changed:
+                # a new matrix rather than writing into the old one, plates handed out before still see their own volumes
+                volumes = self._volumes.copy()
+                volumes[:, columns] = new_volumes
+                self._volumes = volumes
+                self._plates = None
+            for column in changed:
+                self._plate_sums.pop(column, None)
+                self._allocations.pop(column, None)
+                self._worklists = None
+        self._stale_columns.clear()
+
+    @property
+    def plates(self):
+        """
+        :return: list of PlateView, one per target plate (see generate_target_vols)
+        """
+        with self._lock:
+            self._refresh_volumes()
+            if self._plates is None:
+                well_codes = well_order(self.plate_size, self.orientation, codes=True)
+                target_wells = well_names(self.plate_size)
+                n_rows = len(self._volumes) * self.replicates
+                self._plates = [PlateView(self._volumes, self.reagents, i, min(i + self.plate_size, n_rows), self.replicates, well_codes[:min(self.plate_size, n_rows - i)], target_wells) for i in range(0, n_rows, self.plate_size)]
+            return self._plates
+
+    def _reagent_column(self, column):
+        """
+        :return: the reagent's volume in every replicated row, in dispense order
+        """
+        volumes = self._volumes[:, column]
+        return np.repeat(volumes, self.replicates) if self.replicates != 1 else volumes
+
+    def target_well_info(self):
+        """
+        Same as calculate_target_well_info_per_df, from the remembered sums
+        :return:
+        sum_dictionary_list: the volume of reagent (in pl) on each plate
+        starting_wells_dictionary_list: the number of source wells required per reagent on each plate
+        """
+        with self._lock:
+            plates = self.plates
+            starts = np.array([plate.start for plate in plates], dtype=np.int64)
+            with stage('pipeline_plate_sums', columns=len(self.reagents) - len(self._plate_sums)):
+                for column in range(len(self.reagents)):
+                    if column not in self._plate_sums:
+                        self._plate_sums[column] = np.add.reduceat(self._reagent_column(column), starts) if len(starts) else np.zeros(0, dtype=np.int64)
+            sums = np.column_stack([self._plate_sums[column] for column in range(len(self.reagents))]) if plates else np.zeros((0, len(self.reagents)), dtype=np.int64)
+            wells_needed = -(-sums // self.source_plate.usable_volume_pl)
+            return ([dict(zip(self.reagents, row.tolist())) for row in sums], [dict(zip(self.reagents, row.tolist())) for row in wells_needed])
+
+    def worklists(self, progress=None):
+        """
+        The worklist of every plate, from get_source_wells, only packing the reagents that changed
+        :param progress: optional callback, called with (plates done, total plates) as each plate's worklist is joined
+        :return: list of compact worklists, one per plate
+        """
+        with self._lock:
+            plates = self.plates
+            if self._worklists is not None:
+                if progress is not None:
+                    progress(len(plates), len(plates))
+                return list(self._worklists)
+            stale = [column for column in range(len(self.reagents)) if column not in self._allocations]
+            with stage('pipeline_allocate', columns=len(stale), plates=len(plates)):
+                for column in stale:
+                    self._allocations[column] = allocate_reagent(self._reagent_column(column), self.source_plate.usable_volume_pl)
+            #laying the reagents out over the source plates, see source_plan.place_reagents
+            allocations = [self._allocations[column] for column in range(len(self.reagents))]
+            well_counts = [0 if allocation is None else int(allocation[2][-1]) + 1 for allocation in allocations]
+            first_wells, _ = place_reagents(well_counts, self.source_plate.n_wells)
+            allocations = [None if allocation is None else (allocation[0], allocation[1], first_well + allocation[2]) for allocation, first_well in zip(allocations, first_wells)]
+            #one categorical dtype of the source wells shared by every plate's worklist
+            source_wells_list = pd.CategoricalDtype(self.source_plate.well_names())
+            df_list = []
+            with stage('pipeline_assemble', plates=len(plates)):
+                for plate in plates:
+                    plate_allocations = [plate_slice(allocation, plate.start, plate.stop) for allocation in allocations]
+                    df_list.append(assemble_plate_worklist(plate_allocations, plate.wells(), list(self.reagents), source_wells_list))
+                    if progress is not None:
+                        progress(len(df_list), len(plates))
+            self._worklists = df_list
+            return list(df_list)
+
+    def run(self, final_csv_buffer, optimize_order=False, instrument=None, progress=None, **parameters):
+        """
+        Updates the parameters (see update) and writes the iDOT .csv, like doe_to_idot_main
+        :param final_csv_buffer: the output buffer (or path) for the iDOT .csv file
+        :param optimize_order: reorder each plate's dispenses to shorten the estimated run time
+        :param instrument: InstrumentModel used for the run time estimate (and the reordering)
+        :param progress: optional callback, called with (plates done, total plates)
+        :param parameters: final_volume, starting_conc_dict, replicates, orientation, plate_size and source_plate, passed to update
+        :return: estimated run time of the worklist in seconds
+        """
+        with self._lock:
+            self.update(**parameters)
+            final_df_list = self.worklists(progress=progress)
+            if optimize_order:
+                with stage('optimize_worklists', plates=len(final_df_list)):
+                    final_df_list = optimize_worklists(final_df_list, instrument)
+            with stage('generate_csv_file', plates=len(final_df_list)):
+                generate_csv_file(final_csv_buffer, final_df_list, dispense_plate=f'MWP {self.plate_size}', source_plate=self.source_plate)
+            with stage('estimate_run_time', plates=len(final_df_list)) as record:
+                record['estimated_seconds'] = estimate_run_time(final_df_list, instrument)
+            return record['estimated_seconds']
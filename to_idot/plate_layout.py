@@ -0,0 +1,78 @@
+"""
+Well names and dispense order for the plate formats the iDOT can dispense into
+"""
+from functools import lru_cache
+import string
+
+import numpy as np
+import pandas as pd
+
+# number of rows and columns for each plate format
+PLATE_FORMATS = {96: (8, 12), 384: (16, 24), 1536: (32, 48)}
+
+
+def _row_letters(n_rows):
+    """
+    Row names for a plate, A-Z then AA, AB... for plates with more than 26 rows (1536-well)
+    :param n_rows: number of rows on the plate
+    :return: list of row names
+    """
+    letters = list(string.ascii_uppercase)
+    return (letters + [f'{first}{second}' for first in letters for second in letters])[:n_rows]
+
+
+@lru_cache(maxsize=None)
+def well_names(plate_size=96):
+    """
+    All of the wells on a plate, going along the rows (A1, A2... A12, B1...)
+    :param plate_size: number of wells on the plate, 96, 384 or 1536
+    :return: read-only numpy array of well names
+    """
+    if plate_size not in PLATE_FORMATS:
+        raise ValueError(f'Unsupported plate size {plate_size}, use one of {sorted(PLATE_FORMATS)}')
+    n_rows, n_cols = PLATE_FORMATS[plate_size]
+    wells = np.array([f'{row}{col}' for row in _row_letters(n_rows) for col in range(1, n_cols + 1)], dtype=object)
+    wells.flags.writeable = False
+    return wells
+
+
+@lru_cache(maxsize=None)
+def _well_order_codes(plate_size, by_columns):
+    codes = np.arange(len(well_names(plate_size)), dtype=np.int32)
+    if by_columns:
+        n_rows, n_cols = PLATE_FORMATS[plate_size]
+        # going down each column in turn (A1, B1... H1, A2...)
+        codes = codes.reshape(n_rows, n_cols).T.ravel()
+    codes.flags.writeable = False
+    return codes
+
+
+@lru_cache(maxsize=None)
+def _well_order(plate_size, by_columns):
+    wells = well_names(plate_size)[_well_order_codes(plate_size, by_columns)]
+    wells.flags.writeable = False
+    return wells
+
+
+def well_order(plate_size=96, orientation='by_columns', codes=False):
+    """
+    The order the wells of a plate are filled in
+    :param plate_size: number of wells on the plate, 96, 384 or 1536
+    :param orientation: by columns is default, anything else will be taken as by rows
+    :param codes: give the position of each well in well_names(plate_size) instead of its name
+    :return: read-only numpy array of well names (or codes) in dispense order, cached per plate size and orientation
+    """
+    if codes:
+        return _well_order_codes(plate_size, orientation == 'by_columns')
+    return _well_order(plate_size, orientation == 'by_columns')
+
+
+def empty_map(size=96):
+    """
+    Lightweight plate map with the same well index as platemapping.plate_map.empty_map, but no columns.
+    Avoids importing platemapping (and with it matplotlib) when only the well names are needed.
+    :param size: number of wells on the plate, 96, 384 or 1536
+    :return: empty dataframe indexed by well name (A1, A2...)
+    """
+    return pd.DataFrame(index=pd.Index(well_names(size)))
+
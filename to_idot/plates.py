@@ -0,0 +1,99 @@
+"""
+Target plates as views onto the design
+
+A PlateView doesn't hold its own copy of the volumes. It points at the volume matrix of the whole design (one row
+per condition, before replicating) and knows which run of replicated rows it covers, so a design with many replicates
+is never repeated in memory. The plate's rows are only put together, one plate at a time, when a stage reads them.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True, eq=False)
+class PlateView:
+    """
+    One target plate of a DoE design
+    :param conditions: int64 volume matrix (pl) of the whole design, one row per condition and one column per reagent, shared between plates
+    :param reagents: reagent names, in the same order as the columns of conditions
+    :param start: first replicated row on this plate (replicated row i is condition i // replicates)
+    :param stop: one past the last replicated row on this plate
+    :param replicates: the number of replicates per condition
+    :param well_codes: position of each row's target well in well_names, in dispense order
+    :param well_names: names of the target plate's wells
+    """
+    conditions: np.ndarray
+    reagents: tuple
+    start: int
+    stop: int
+    replicates: int
+    well_codes: np.ndarray
+    well_names: pd.Index
+
+    def __len__(self):
+        return self.stop - self.start
+
+    @property
+    def columns(self):
+        """
+        Column names of the plate as a dataframe, the reagents then 'Well'
+        """
+        return pd.Index(list(self.reagents) + ['Well'])
+
+    @property
+    def condition_index(self):
+        """
+        The condition (row of conditions) in each well of the plate
+        """
+        return np.arange(self.start, self.stop) // self.replicates
+
+    def volumes(self):
+        """
+        :return: int64 matrix of the volumes (pl) on this plate, one row per well and one column per reagent.
+        A view onto the design when there are no replicates, otherwise only this plate's rows are made
+        """
+        if self.replicates == 1:
+            return self.conditions[self.start:self.stop]
+        return self.conditions[self.condition_index]
+
+    def wells(self):
+        """
+        :return: categorical of the target well names, in dispense order
+        """
+        return pd.Categorical.from_codes(self.well_codes, categories=self.well_names)
+
+    def __getitem__(self, column):
+        if column == 'Well':
+            return pd.Series(self.wells(), name='Well')
+        return pd.Series(self.volumes()[:, self.reagents.index(column)], name=column)
+
+    def to_frame(self):
+        """
+        :return: the plate as a dataframe (one column per reagent, then 'Well'), as it was before plates were views
+        """
+        df = pd.DataFrame(self.volumes(), columns=list(self.reagents))
+        df['Well'] = self.wells()
+        return df
+
+
+def plate_volumes(plate):
+    """
+    The volume matrix of one plate, for a PlateView or a dataframe with one column per reagent then 'Well'
+    :return:
+    reagents: list of the reagent names
+    volumes: int64 matrix of volumes, one row per well and one column per reagent
+    """
+    if isinstance(plate, PlateView):
+        return list(plate.reagents), plate.volumes()
+    reagents = list(plate.columns[:-1])
+    return reagents, plate[reagents].to_numpy(dtype=np.int64)
+
+
+def plate_wells(plate):
+    """
+    :return: categorical of the target wells of one plate, for a PlateView or a dataframe
+    """
+    if isinstance(plate, PlateView):
+        return plate.wells()
+    return pd.Categorical(plate['Well'])
@@ -1,141 +1,202 @@
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
-import platemapping.plate_map as pm
 #import extra_app.to_idot.doe_to_idot as dti
 
-from doe_to_idot import calculate_target_well_info_per_df, get_source_wells, generate_csv_file
+from .doe_to_idot import get_source_wells, generate_csv_file
+from .instrumentation import logger, stage
+from .plate_layout import empty_map
+from .units import to_picolitres
 
 
-def generate_df_from_template(path_to_template:str, volume_dna:float, primers_volume:float, final_volume_without_master_mix:float, primer_tubes_choice:int):
+@dataclass(frozen=True)
+class QpcrTemplate:
     """
-    This function takes excel template with well info and converts into a .csv file for the idot
-    :param path_to_template:
+    A parsed qPCR excel template, the wells that have both a group and a target
+    :param table: the template's 'Sheet1' with the empty wells dropped, treat as read-only (it is shared through the cache)
+    :param source: path the template was read from (None if it was read from a buffer)
+    :param mtime_ns: modification time of the file when it was read
+    """
+    table: pd.DataFrame
+    source: str = None
+    mtime_ns: int = None
+
+    @property
+    def key(self):
+        """
+        Identifies this version of the template file, (path, mtime)
+        """
+        return self.source, self.mtime_ns
+
+
+def _parse_template(template_file):
+    #importing the excel template file as a dataframe
+    table = pd.read_excel(template_file, sheet_name='Sheet1')
+    table.dropna(subset=['Group', 'Target'], inplace=True)
+    return table
+
+
+@functools.lru_cache(maxsize=16)
+def _load_template_file(path, mtime_ns):
+    return QpcrTemplate(_parse_template(path), path, mtime_ns)
+
+
+def load_qpcr_template(template):
+    """
+    Reads a qPCR template once, files are cached on their path and modification time so a template is only parsed
+    again after it has been saved
+    :param template: path to the excel template, a file buffer, or an already loaded QpcrTemplate
+    :return: QpcrTemplate
+    """
+    if isinstance(template, QpcrTemplate):
+        return template
+    if isinstance(template, (str, Path)):
+        path = os.path.abspath(template)
+        return _load_template_file(path, os.stat(path).st_mtime_ns)
+    return QpcrTemplate(_parse_template(template))
+
+
+def generate_df_from_templates(templates, volume_dna:float, primers_volume:float, final_volume_without_master_mix:float, primer_tubes_choice:int):
+    """
+    Builds one target plate per qPCR template, all with the same columns so the plates can share one source plate:
+    every group, primer and the water over all the templates, in the order they first appear
+    :param templates: list of paths to the excel templates, file buffers or QpcrTemplate (see load_qpcr_template)
     :param volume_dna:
     :param primers_volume:
     :param final_volume_without_master_mix:
     :param primer_tubes_choice:
-    :return:
+    :return: list of dataframes, one per template, and the source plate map
     """
-    #importing the excel template file as a dataframe
-    table = pd.read_excel(path_to_template, sheet_name='Sheet1')
-    print(table)
-    table.dropna(subset=['Group', 'Target'], inplace=True)
-    #making a list of unique groups (removing duplicates)
-    unique_groups = []
-    for value in table.Group:
-        if value not in unique_groups:
-            unique_groups.append(value)
-    #making a list of unique targets (removing duplicates)
-    unique_targets = []
-    #if there is only 1 tube of primers do the following
+    #the parsed templates, only read from the files the first time
+    tables = [load_qpcr_template(template).table for template in templates]
+    #all the wells of all the plates one after another, so the groups and targets are shared between plates
+    table = pd.concat(tables) if len(tables) > 1 else tables[0]
+    #unique groups and targets in the order they first appear, with the code of each row's group and target
+    group_codes, unique_groups = pd.factorize(table['Group'])
+    target_codes, targets = pd.factorize(table['Target'])
+    unique_groups = list(unique_groups)
+    #if there is only 1 tube of primers, one column per target
     if primer_tubes_choice == 1:
-        for value in table.Target:
-            if value not in unique_targets:
-                unique_targets.append(value)
-
+        unique_targets = list(targets)
     #if there are 2 primer tubes, suffix with _1 or _2 (forward and reverse primer tubes)
     elif primer_tubes_choice == 2:
-        for value in table.Target:
-            if f'{value}_1' not in unique_targets:
-                value_1 = f'{value}_1'
-                unique_targets.append(value_1)
-            if f'{value}_2' not in unique_targets:
-                value_2 = f'{value}_2'
-                unique_targets.append(value_2)
-
-    print(f'unique_groups: {unique_groups}')
-    print(f'unique_targets: {unique_targets}')
-    #combining the lists of unique items generated above
-    collated_list = unique_groups + unique_targets
-    unique_targets_index = 0
-    #making dataframe with unique groups and targets generated above
-    df = pd.DataFrame(columns=collated_list)
-    #making a column for water, filling water wells with 0 by default
-    df['water'] = 0
-    #defining a column for wells based on the original imported table
-    df['Well'] = table['Wells']
-
-    #print(f'first_df: {df}')
-    # calculating how to populate the rest of the dataframe
-    if primer_tubes_choice == 1:
-        for i, row in enumerate(table['Group']):
-            #calculating how much DNA volume to add to each well (row)
-            df[row].iloc[i] = volume_dna/table['Dilution'].iloc[i]
-            #working out how much water to top up to final volume (excluding master mix)
-            df['water'].iloc[i] = final_volume_without_master_mix - ((volume_dna/table['Dilution'].iloc[i]) + primers_volume)
-        #filling the primer column
-        for i, row in enumerate(table['Target']):
-            #print(f'row: {row}')
-            df[row].iloc[i] = primers_volume
-    # slightly different maths for 2 primer tubes vs 1
-    elif primer_tubes_choice == 2:
-        for i, row in enumerate(table['Group']):
-            df[row].iloc[i] = volume_dna/table['Dilution'].iloc[i]
-            df['water'].iloc[i] = final_volume_without_master_mix - ((volume_dna/table['Dilution'].iloc[i]) + (primers_volume*2))
-        for i, row in enumerate(table['Target']):
-            #print(f'row: {row}')
-            df[f'{row}_1'].iloc[i] = primers_volume
-            df[f'{row}_2'].iloc[i] = primers_volume
-    #fill all other cells with 0
-    df = df.fillna(0)
-    print(df)
+        unique_targets = [f'{value}_{tube}' for value in targets for tube in (1, 2)]
+    else:
+        unique_targets = []
+
+    logger.debug('unique_groups: %s unique_targets: %s', unique_groups, unique_targets)
+    #combining the lists of unique items generated above, then a column for water
+    collated_list = unique_groups + unique_targets + ['water']
+    n_groups = len(unique_groups)
+    rows = np.arange(len(table))
+    #one row per well, one column per group/primer tube plus water, 0 wherever nothing is added
+    volumes = np.zeros((len(table), len(collated_list)))
+    if primer_tubes_choice in (1, 2):
+        dna_volumes = volume_dna / table['Dilution'].to_numpy(dtype=float)
+        #one hot: the DNA volume in each well's group column
+        volumes[rows, group_codes] = dna_volumes
+        #and the primer volume in its target's column (or both tube columns)
+        for tube in range(primer_tubes_choice):
+            volumes[rows, n_groups + target_codes * primer_tubes_choice + tube] = primers_volume
+        #working out how much water to top up to final volume (excluding master mix)
+        volumes[:, -1] = final_volume_without_master_mix - (dna_volumes + (primers_volume * primer_tubes_choice))
+    #wells without a dilution get nothing added
+    volumes[np.isnan(volumes)] = 0
 
     # generating an empty plate map
-    map = pm.empty_map()
-    #creating a list of cols
-    cols=[i for i in df.columns if i not in ["Well"]]
-    #print(f'cols:{cols}')
-    for col in cols:
-        df[col]=pd.to_numeric(df[col])
-    #needs to be in list for other code to work
-    df = [df]
-    return df, map
-
-
-def qPCR_to_idot_main(path_to_template_file, path_to_output_file, volume_dna, primers_volume, final_volume_without_master_mix, primer_tubes_choice:int):
+    map = empty_map()
+    #volumes are carried as picolitres from here on, split back into one plate per template
+    plate_volumes = np.split(to_picolitres(volumes), np.cumsum([len(plate_table) for plate_table in tables])[:-1])
+    df_list = []
+    for plate_table, plate_volume in zip(tables, plate_volumes):
+        df = pd.DataFrame(plate_volume, columns=collated_list, index=plate_table.index)
+        #defining a column for wells based on the original imported table
+        df['Well'] = plate_table['Wells']
+        df_list.append(df)
+    return df_list, map
+
+
+def generate_df_from_template(path_to_template:str, volume_dna:float, primers_volume:float, final_volume_without_master_mix:float, primer_tubes_choice:int):
+    """
+    This function takes excel template with well info and converts into a .csv file for the idot
+    :param path_to_template: path to the excel template, a file buffer or a QpcrTemplate (see load_qpcr_template)
+    :param volume_dna:
+    :param primers_volume:
+    :param final_volume_without_master_mix:
+    :param primer_tubes_choice:
+    :return: the plate's dataframe in a list (for the other code to work) and the source plate map
+    """
+    return generate_df_from_templates([path_to_template], volume_dna, primers_volume, final_volume_without_master_mix, primer_tubes_choice)
+
+
+def qPCR_to_idot_main(in_df, output_file_buffer, volume_dna, primers_volume, final_volume_without_master_mix, primer_tubes_choice:int):
     """
     Main file bringing together the functions from this file and the doe_to_idot file
-    :param path_to_template_file:
-    :param path_to_output_file:
+    :param in_df: path to the excel template, a file buffer or a QpcrTemplate (see load_qpcr_template), or a list of
+    them for one run with a target plate per template. The plates share the source plate(s): a DNA group or primer
+    used on more than one plate, and the water, is loaded once and pooled over the plates
+    :param output_file_buffer:
     :param volume_dna:
     :param primers_volume:
     :param final_volume_without_master_mix:
     :param primer_tubes_choice:
     :return:
     """
+    templates = list(in_df) if isinstance(in_df, (list, tuple)) else [in_df]
+    with stage('generate_df_from_template', templates=len(templates)) as record:
+        df, map = generate_df_from_templates(templates, volume_dna, primers_volume, final_volume_without_master_mix, primer_tubes_choice)
+        record['output_rows'] = sum(len(plate) for plate in df)
+    with stage('get_source_wells', plates=len(df)) as record:
+        df = get_source_wells(df, map=map)
+        record['output_rows'] = sum(len(plate) for plate in df)
+    with stage('generate_csv_file', plates=len(df)):
+        generate_csv_file(output_file_buffer, df, idot_header=True, dispense_plate='qpcr plate')
 
-    df, map = generate_df_from_template(path_to_template_file, volume_dna, primers_volume, final_volume_without_master_mix, primer_tubes_choice)
-    #print(df)
-    sum_dictionary_list, starting_wells_dictionary_list = calculate_target_well_info_per_df(df, 1)
-    #print(f'sum_dictionary_list: {sum_dictionary_list}, starting_wells_dictionary_list:{starting_wells_dictionary_list}')
-    df = get_source_wells(df, sum_dictionary_list, starting_wells_dictionary_list, map)
-    generate_csv_file(path_to_output_file, df, idot_header=True, dispense_plate='qpcr plate')
 
 def plate_template_gen(path_to_template_file):
     """
     Generates a .csv file which works with the CFX instrument and analysis software
-    :param path_to_template_file: str
+    :param path_to_template_file: path to the excel template, a file buffer or a QpcrTemplate (see load_qpcr_template)
     :return: dataframe in list
     """
-    table = pd.read_excel(path_to_template_file, sheet_name='Sheet1')
-    #print(f'table: {table}')
-    table.dropna(subset=['Group', 'Target'], inplace=True)
-    #print(f'table2: {table}')
-    pt_df = pd.DataFrame(columns = ['Row','Column','*Target Name','*Sample Name','*Biological Group'])
-    pt_df['Wells'] = table['Wells']
-    for i, well in enumerate(table['Wells']):
-        well_row = well[0]
-        print(f'well_row:{well_row}')
-        well_column = well[1:]
-        pt_df['Row'].iloc[i] = well_row
-        pt_df['Column'].iloc[i] = well_column
-    for i, group in enumerate(table['Group']):
-        pt_df['*Sample Name'].iloc[i] = str(group)
-    for i, target in enumerate(table['Target']):
-        pt_df['*Target Name'].iloc[i] = str(target)
-    pt_df.drop(['Wells'], axis=1, inplace=True)
+    table = load_qpcr_template(path_to_template_file).table
+    wells = table['Wells'].astype(str)
+    #row letter and column number of every well, as whole columns
+    pt_df = pd.DataFrame({
+        'Row': wells.str[0],
+        'Column': wells.str[1:],
+        '*Target Name': table['Target'].astype(str),
+        '*Sample Name': table['Group'].astype(str),
+        '*Biological Group': np.nan,
+    }, index=table.index)
     return [pt_df]
 
 
+def _write_plate_template(template, output_path):
+    generate_csv_file(output_path, plate_template_gen(template), idot_header=False)
+    return output_path
+
+
+def write_plate_templates(templates, output_paths, max_workers=1):
+    """
+    Writes the CFX plate template of many qPCR templates (e.g. one per plate of a campaign), each as soon as it is made
+    :param templates: iterable of paths, file buffers or QpcrTemplate
+    :param output_paths: iterable of paths to write the CFX templates to, in the same order
+    :param max_workers: number of processes to read the excel files with, 1 (default) does them one after another here
+    :return: list of the output paths written
+    """
+    if max_workers > 1:
+        #reading the workbooks is the slow part, so each template is parsed and written in a worker process
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(_write_plate_template, templates, output_paths))
+    return [_write_plate_template(template, output_path) for template, output_path in zip(templates, output_paths)]
+
+
 if __name__ == '__main__':
     # template_file = input('Please provide the path to the template ')
     # idot_choice = input('Are you plating the assay with the idot? (y/n) ')
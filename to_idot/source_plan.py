@@ -0,0 +1,223 @@
+"""
+Run-level planning of the source plates
+
+Every reagent's dispenses for the whole run (all target plates, in dispense order) are packed into as few source wells
+as the well volume allows, instead of starting new wells on every target plate. The reagents are then laid out over
+as few source plates as the wells need, spilling onto more plates when one isn't enough (see place_reagents).
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .plate_layout import well_names
+from .units import SOURCE_WELL_CAPACITY_PL, to_microlitres
+
+
+@dataclass(frozen=True)
+class SourcePlateType:
+    """
+    A type of source plate the reagents are loaded into
+    :param name: plate type as the iDOT knows it, written in the worklist header
+    :param well_volume_pl: volume one source well can be filled with
+    :param dead_volume_pl: volume left in a well that can't be dispensed
+    :param n_wells: number of wells on one plate, 96, 384 or 1536
+    """
+    name: str = 'S.100 Plate'
+    well_volume_pl: int = SOURCE_WELL_CAPACITY_PL
+    dead_volume_pl: int = 0
+    n_wells: int = 96
+
+    @property
+    def usable_volume_pl(self):
+        """
+        Volume that can be dispensed from one well
+        """
+        return self.well_volume_pl - self.dead_volume_pl
+
+    def well_names(self):
+        """
+        :return: names of the wells of one plate, along the rows (A1, A2...)
+        """
+        return well_names(self.n_wells)
+
+
+def _check_dispenses(volumes, max_volume):
+    """
+    Raises a ValueError if a dispense is more than one source well can give, it would be drawn from a single well anyway
+    """
+    if len(volumes) and volumes.max() > max_volume:
+        raise ValueError(f'a dispense of {to_microlitres(volumes.max())} ul is more than the {to_microlitres(max_volume)} ul '
+                         'one source well can give, lower the final volume or the dead volume, or use a more concentrated stock')
+
+
+def split_source_wells(volumes, max_volume=SOURCE_WELL_CAPACITY_PL):
+    """
+    Works out which source well each dispense of one reagent is drawn from.
+    A source well is used until the running total would reach max_volume (so a well is never drawn completely dry), the next one is then started.
+    Uses a cumulative sum of the volumes and searchsorted to find where each well runs out, so it only loops once per source well.
+    :param volumes: 1D array of the (non-zero) volumes in pl dispensed from the reagent, in dispense order
+    :param max_volume: volume of one source well, in pl
+    :return: array the same length as volumes with the offset (0, 1, 2...) of the source well for each dispense
+    :raises ValueError: if a dispense is more than max_volume
+    """
+    volumes = np.asarray(volumes, dtype=np.int64)
+    _check_dispenses(volumes, max_volume)
+    cumulative_volumes = np.cumsum(volumes)
+    well_starts = np.zeros(len(volumes), dtype=np.int64)
+    start = 0
+    while start < len(volumes):
+        well_starts[start] = 1
+        already_used = cumulative_volumes[start - 1] if start else 0
+        #first dispense that would take this well up to the limit, always move on by at least one dispense
+        end = int(np.searchsorted(cumulative_volumes, already_used + max_volume, side='left'))
+        start = max(end, start + 1)
+    return np.cumsum(well_starts) - 1
+
+
+def continue_source_wells(volumes, max_volume=SOURCE_WELL_CAPACITY_PL, state=None):
+    """
+    split_source_wells for a run that comes a batch of dispenses at a time, carrying the well in use over to the next batch.
+    Splitting a run batch by batch gives the same source wells as splitting it in one go.
+    :param volumes: 1D array of the (non-zero) volumes in pl of this batch's dispenses, in dispense order
+    :param max_volume: volume of one source well, in pl
+    :param state: (source well, volume already drawn from it) returned with the previous batch, None before the first dispense
+    :return:
+    well_offsets: offset of each dispense's source well from the reagent's first source well
+    state: to pass in with the next batch
+    """
+    volumes = np.asarray(volumes, dtype=np.int64)
+    if not len(volumes):
+        return np.zeros(0, dtype=np.int64), state
+    _check_dispenses(volumes, max_volume)
+    if state is None:
+        well, used = 0, 0
+        well_offsets = split_source_wells(volumes, max_volume)
+    else:
+        well, used = state
+        #the well in use carries on until the running total would reach max_volume, possibly without any of this batch
+        open_end = int(np.searchsorted(used + np.cumsum(volumes), max_volume, side='left'))
+        well_offsets = np.full(len(volumes), well, dtype=np.int64)
+        if open_end < len(volumes):
+            well_offsets[open_end:] = well + 1 + split_source_wells(volumes[open_end:], max_volume)
+    last_well = int(well_offsets[-1])
+    drawn = int(volumes[well_offsets == last_well].sum()) + (used if last_well == well else 0)
+    return well_offsets, (last_well, drawn)
+
+
+def allocate_reagent(volumes, max_volume=SOURCE_WELL_CAPACITY_PL):
+    """
+    Works out the dispenses of one reagent
+    :param volumes: 1D int64 array of the reagent's volume (pl) in every target well, in dispense order
+    :param max_volume: volume that can be dispensed from one source well
+    :return: None if the reagent is never added, otherwise
+    rows: position of each dispense's target well in volumes
+    volumes: volume of each dispense
+    well_offsets: offset of each dispense's source well from the reagent's first source well (see split_source_wells)
+    """
+    # only the wells that get something added
+    rows = np.flatnonzero(volumes)
+    if not len(rows):
+        return None
+    volumes = volumes[rows]
+    return rows, volumes, split_source_wells(volumes, max_volume)
+
+
+def _in_order(well_counts, n_wells):
+    """
+    The reagents one after another, moving a reagent to the next plate if it doesn't fit in what is left of the current one
+    """
+    first_wells = []
+    next_well = 0
+    for count in well_counts:
+        left_on_plate = n_wells - next_well % n_wells
+        if count > left_on_plate and count <= n_wells:
+            next_well = next_well + left_on_plate
+        first_wells.append(next_well)
+        next_well = next_well + count
+    return first_wells, -(-next_well // n_wells)
+
+
+def _largest_first(well_counts, n_wells):
+    """
+    Reagents needing more than a whole plate start at the top of a plate, the rest go largest first into the first plate with room
+    """
+    first_wells = [0] * len(well_counts)
+    # plate number and wells already used, for every plate with room left
+    open_plates = []
+    n_plates = 0
+    for reagent, count in enumerate(well_counts):
+        if count > n_wells:
+            first_wells[reagent] = n_plates * n_wells
+            n_plates = n_plates + count // n_wells
+            if count % n_wells:
+                open_plates.append([n_plates, count % n_wells])
+                n_plates = n_plates + 1
+    for reagent in sorted(range(len(well_counts)), key=lambda reagent: -well_counts[reagent]):
+        count = well_counts[reagent]
+        if count == 0 or count > n_wells:
+            continue
+        for plate in open_plates:
+            if n_wells - plate[1] >= count:
+                first_wells[reagent] = plate[0] * n_wells + plate[1]
+                plate[1] = plate[1] + count
+                break
+        else:
+            first_wells[reagent] = n_plates * n_wells
+            open_plates.append([n_plates, count])
+            n_plates = n_plates + 1
+    return first_wells, n_plates
+
+
+def place_reagents(well_counts, n_wells):
+    """
+    Lays the reagents out over as few source plates as possible, each reagent starting in a new well.
+    The reagents are kept in order and whole on one plate if that takes no more plates than the wells strictly need,
+    otherwise they are packed largest first, and if even that wastes a plate they are laid end to end (some then
+    straddle two plates).
+    :param well_counts: number of source wells each reagent needs (0 if it isn't used)
+    :param n_wells: number of wells on one source plate
+    :return:
+    first_wells: run-wide index of each reagent's first source well (plate = index // n_wells)
+    n_plates: number of source plates used
+    """
+    fewest_plates = -(-sum(well_counts) // n_wells)
+    for layout in (_in_order, _largest_first):
+        first_wells, n_plates = layout(well_counts, n_wells)
+        if n_plates <= fewest_plates:
+            return first_wells, n_plates
+    #end to end, no plate is wasted
+    return np.cumsum([0] + list(well_counts[:-1])).tolist() if well_counts else [], fewest_plates
+
+
+def plan_source_wells(reagent_volumes, plate_type=None):
+    """
+    Packs every reagent's dispenses for the whole run into source wells on one or more source plates
+    :param reagent_volumes: for each reagent, a 1D int64 array of its volume (pl) in every target well of the run, in dispense order
+    :param plate_type: SourcePlateType, the default S.100 plate if not given
+    :return: list with, for each reagent, None if it is never added, otherwise
+    rows: position of each dispense's target well in the run
+    volumes: volume of each dispense
+    source_wells: run-wide index of each dispense's source well (source plate = index // n_wells)
+    """
+    plate_type = plate_type or SourcePlateType()
+    allocations = [allocate_reagent(volumes, plate_type.usable_volume_pl) for volumes in reagent_volumes]
+    well_counts = [0 if allocation is None else int(allocation[2][-1]) + 1 for allocation in allocations]
+    first_wells, _ = place_reagents(well_counts, plate_type.n_wells)
+    return [None if allocation is None else (allocation[0], allocation[1], first_well + allocation[2]) for allocation, first_well in zip(allocations, first_wells)]
+
+
+def plate_slice(allocation, start, stop):
+    """
+    The part of a run-wide reagent allocation on one target plate
+    :param allocation: one reagent's entry from plan_source_wells (or None)
+    :param start: first row of the run on the plate
+    :param stop: one past the last row of the run on the plate
+    :return: None if the reagent isn't added to the plate, otherwise (rows on the plate, volumes, source wells)
+    """
+    if allocation is None:
+        return None
+    rows, volumes, source_wells = allocation
+    first, last = np.searchsorted(rows, [start, stop])
+    if first == last:
+        return None
+    return rows[first:last] - start, volumes[first:last], source_wells[first:last]
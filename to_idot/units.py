@@ -0,0 +1,34 @@
+"""
+Fixed-point volumes: the pipelines carry every volume as a whole number of picolitres (int64), in steps of 100 pl
+(the 0.1 nl, 4 decimal places of ul, the iDOT files have always been written to). Volumes are converted from ul when
+they are first calculated and back to ul only when the iDOT .csv is written
+"""
+import numpy as np
+
+PL_PER_UL = 1000000
+# volumes are rounded to the nearest 0.1 nl
+VOLUME_STEP_PL = 100
+# the most that can be drawn from one S.100 source well, 80 ul (the 8.00E-05 l in the iDOT header)
+SOURCE_WELL_CAPACITY_PL = 80 * PL_PER_UL
+
+
+def to_picolitres(volumes_ul):
+    """
+    Converts ul to picolitres, rounding to the nearest 0.1 nl (VOLUME_STEP_PL)
+    :param volumes_ul: number or array of volumes in ul
+    :return: int64 array (or numpy integer) of volumes in pl
+    :raises ValueError: if any volume is NaN or infinite (e.g. a blank concentration in the design)
+    """
+    volumes_ul = np.asarray(volumes_ul, dtype=float)
+    if not np.isfinite(volumes_ul).all():
+        raise ValueError('volumes must be finite numbers, check for blank or zero concentrations')
+    return np.rint(volumes_ul * (PL_PER_UL // VOLUME_STEP_PL)).astype(np.int64) * VOLUME_STEP_PL
+
+
+def to_microlitres(volumes_pl):
+    """
+    Converts picolitres back to ul, for output
+    :param volumes_pl: number or array of volumes in pl
+    :return: float array of volumes in ul
+    """
+    return np.asarray(volumes_pl, dtype=np.int64) / PL_PER_UL
@@ -0,0 +1,132 @@
+"""
+One copy of each uploaded design for the whole server
+
+Uploads are parsed once and stored on local disk as uncompressed Feather files named by the sha256 of the uploaded
+bytes, so the same design uploaded by any number of sessions is stored once. Sessions keep only the hash. Reading a
+design back memory-maps the file: numeric columns point straight at the page cache instead of being copied into
+each session. The store has a size cap, the least recently used designs are deleted first when it is full (a
+design still open elsewhere stays readable until it is let go, the file is only unlinked).
+"""
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+import threading
+
+import pandas as pd
+
+from .design_io import read_design
+
+
+class UploadStore:
+    """
+    Content addressed, size capped store of parsed designs, safe to share between threads
+    """
+    def __init__(self, directory, max_bytes=512 * 1024 ** 2):
+        """
+        :param directory: where the Feather files are kept, created if needed. Designs already there are picked up
+        :param max_bytes: total size of the files kept, the least recently used are deleted past it
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # digest to file size, least recently used first
+        self._sizes = OrderedDict()
+        for path in sorted(self.directory.glob('*.feather'), key=lambda path: path.stat().st_mtime):
+            self._sizes[path.stem] = path.stat().st_size
+
+    def _path(self, digest):
+        return self.directory / f'{digest}.feather'
+
+    @property
+    def total_bytes(self):
+        return sum(self._sizes.values())
+
+    def __contains__(self, digest):
+        return digest in self._sizes
+
+    def put(self, data):
+        """
+        Stores an uploaded design, unless the same bytes are already stored
+        :param data: the uploaded file's bytes
+        :return: sha256 of the bytes, the reference to get the design back with
+        """
+        return self.get_or_put(data)[0]
+
+    def get_or_put(self, data):
+        """
+        The design of an upload, stored first if it isn't already (never was, or was evicted).
+        The file is opened while the store is locked, so another session evicting it can't get in between
+        :param data: the uploaded file's bytes
+        :return:
+        digest: sha256 of the bytes
+        df: dataframe of the design, memory-mapped (see get)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            table = self._open(digest) if digest in self._sizes else None
+        if table is None:
+            table = self._write(digest, data)
+        return digest, _to_frame(table)
+
+    def get(self, digest):
+        """
+        The stored design, memory-mapped
+        :param digest: reference returned by put
+        :return: dataframe of the design, its numeric columns are read-only views of the file
+        :raises KeyError: if the design isn't stored (never was, or was evicted), use get_or_put
+        """
+        with self._lock:
+            if digest not in self._sizes:
+                raise KeyError(digest)
+            table = self._open(digest)
+        return _to_frame(table)
+
+    def _open(self, digest):
+        # called with the lock held
+        from pyarrow import feather
+        self._sizes.move_to_end(digest)
+        return feather.read_table(self._path(digest), memory_map=True)
+
+    def _write(self, digest, data):
+        """
+        Parses and stores an upload, then opens it before anything can be evicted
+        """
+        from pyarrow import feather
+        df = read_design(data)
+        # feather needs string column names and the default index
+        df = df.set_axis([str(column) for column in df.columns], axis=1).reset_index(drop=True)
+        # written under a temporary name and renamed, so a half written file is never read
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(handle)
+        # one record batch and no compression, so the columns can be memory-mapped as they are
+        feather.write_feather(df, temp_path, compression='uncompressed', chunksize=max(len(df), 1))
+        os.replace(temp_path, self._path(digest))
+        with self._lock:
+            self._sizes[digest] = self._path(digest).stat().st_size
+            table = self._open(digest)
+            self._evict()
+        return table
+
+    def _evict(self):
+        # the newest design is always kept, even on its own past the cap
+        while len(self._sizes) > 1 and self.total_bytes > self.max_bytes:
+            digest, _ = self._sizes.popitem(last=False)
+            self._path(digest).unlink(missing_ok=True)
+
+
+def _to_frame(table):
+    """
+    Dataframe of a memory-mapped table, without copying the columns that can be mapped
+    """
+    import pyarrow as pa
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        try:
+            columns[name] = column.chunk(0).to_numpy(zero_copy_only=True)
+        except (pa.ArrowInvalid, IndexError):
+            # strings, missing values or an empty design can't be mapped, those columns are copied
+            columns[name] = column.to_pandas()
+    return pd.DataFrame(columns, columns=table.column_names, copy=False)
@@ -0,0 +1,71 @@
+"""
+Compact in-memory worklists
+
+A worklist is a dataframe with one row per dispense. Inside the pipeline the wells and liquid names are categoricals
+(small integer codes plus one shared list of names), volumes are picolitres in int32 and 'Source Plate' numbers the
+source plate each dispense is drawn from. The iDOT layout (ul and the blank padding columns) is only produced when
+the .csv is written.
+"""
+import numpy as np
+import pandas as pd
+
+from .units import to_microlitres
+
+WORKLIST_COLUMNS = ['Source Well', 'Target Well', 'Volume [pl]', 'Liquid Name', 'Source Plate']
+# what the iDOT expects in the .csv, including the 5 blank columns
+IDOT_COLUMNS = ['Source Well', 'Target Well', 'Volume [ul]', 'Liquid Name', '', '', '', '', '']
+
+
+def _category_dtype(names):
+    """
+    Categorical dtype for a list of names, reusing the one passed in so every plate shares the same list of names
+    """
+    if isinstance(names, pd.CategoricalDtype):
+        return names
+    return pd.CategoricalDtype(pd.Index(names))
+
+
+def make_worklist(source_codes, source_wells, target_codes, target_wells, volumes_pl, liquid_codes, liquids, source_plates=None):
+    """
+    Builds a compact worklist from integer codes
+    :param source_codes: index into source_wells for every dispense
+    :param source_wells: names of the source wells (or a CategoricalDtype of them, to share it between plates)
+    :param target_codes: index into target_wells for every dispense
+    :param target_wells: names of the target wells (or a CategoricalDtype)
+    :param volumes_pl: volume of every dispense in pl
+    :param liquid_codes: index into liquids for every dispense
+    :param liquids: names of the liquids (reagents)
+    :param source_plates: source plate (0, 1, 2...) of every dispense, all on the first plate if not given
+    :return: worklist dataframe
+    """
+    return pd.DataFrame({
+        'Source Well': pd.Categorical.from_codes(np.asarray(source_codes, dtype=np.int32), dtype=_category_dtype(source_wells)),
+        'Target Well': pd.Categorical.from_codes(np.asarray(target_codes, dtype=np.int32), dtype=_category_dtype(target_wells)),
+        'Volume [pl]': np.asarray(volumes_pl, dtype=np.int32),
+        'Liquid Name': pd.Categorical.from_codes(np.asarray(liquid_codes, dtype=np.int32), dtype=_category_dtype(liquids)),
+        'Source Plate': np.zeros(len(volumes_pl), dtype=np.int16) if source_plates is None else np.asarray(source_plates, dtype=np.int16),
+    })
+
+
+def is_worklist(df):
+    """
+    :return: True if the dataframe is a compact worklist (rather than e.g. a CFX template)
+    """
+    return 'Volume [pl]' in df.columns and 'Source Well' in df.columns
+
+
+def to_idot_layout(worklist):
+    """
+    Converts a compact worklist to the layout written to the iDOT .csv
+    :param worklist: worklist dataframe
+    :return: dataframe with the volumes in ul and the blank padding columns
+    """
+    idot_df = pd.DataFrame({
+        'Source Well': worklist['Source Well'],
+        'Target Well': worklist['Target Well'],
+        'Volume [ul]': to_microlitres(worklist['Volume [pl]'].to_numpy()),
+        'Liquid Name': worklist['Liquid Name'],
+    })
+    for _ in range(5):
+        idot_df.insert(len(idot_df.columns), '', '', allow_duplicates=True)
+    return idot_df